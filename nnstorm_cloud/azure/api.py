@@ -7,13 +7,27 @@ import logging
 from pathlib import Path
 from typing import Type
 
+import requests
 from msrest.service_client import SDKClient
 from nnstorm_cloud.azure.cred_wrapper import CredentialWrapper
+from requests.adapters import HTTPAdapter
 
 from azure.common.credentials import ServicePrincipalCredentials
+from azure.core.pipeline.transport import RequestsTransport
 from azure.graphrbac import GraphRbacManagementClient
 from azure.identity import ClientSecretCredential
-from azure.mgmt.storage import StorageManagementClient
+
+
+_SUPPRESSED_LOGGERS = (
+    "azure",
+    "azure.core",
+    "adal-python",
+    "urllib3",
+    "msrest",
+    "msal",
+    "azure.storage",
+    "azure.identity",
+)
 
 
 class AzureError(RuntimeError):
@@ -23,6 +37,12 @@ class AzureError(RuntimeError):
 class AzureApi:
     """Base class for Azure Xmind operations with logger and identity handling"""
 
+    _logs_suppressed = False
+    # seconds between polls of long running operations when Azure does not suggest an interval (SDK default: 30)
+    polling_interval = 5
+    # retries with exponential backoff of the azure-core based clients, throttling (429) and 5xx errors are retried
+    retry_settings = {"retry_total": 5, "retry_backoff_factor": 1.0}
+
     def __init__(self, azure_auth_path: Path):
         """Initialize the class including identity path, logger, logging configuration.
 
@@ -39,27 +59,71 @@ class AzureApi:
         if not azure_auth_path.is_file():
             raise AzureError()
         self.azure_auth_path = azure_auth_path
+        self._auth = self._load_azure_credential()
 
+        client_id, client_secret, tenant_id = self._get_client_id(), self._get_client_secret(), self._get_tenant_id()
         self.client_secret_credentials = ClientSecretCredential(
-            client_secret=self._get_client_secret(), client_id=self._get_client_id(), tenant_id=self._get_tenant_id()
-        )
-        self.service_principal_credentials = ServicePrincipalCredentials(
-            client_id=self._get_client_id(), secret=self._get_client_secret(), tenant=self._get_tenant_id()
+            client_secret=client_secret, client_id=client_id, tenant_id=tenant_id
         )
+        self._service_principal_credentials = None
+        self._credential_wrappers = {}
         self.credentials = self._get_client_secret_credential()
         self.subscription_id = self._get_subscription_id()
 
         self._clients = {}
+        self._graph_credentials = None
+        self._graph_client = None
+        self._object_id = None
+        self._graph_filter = f"servicePrincipalNames/any(c:c eq '{client_id}')"
+
+        # one connection pool shared by every azure-core based client, so TLS sessions are reused between them
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=50))
+        self._transport = RequestsTransport(session=self._session, session_owner=False)
+
+    def close(self) -> None:
+        """Close the cached clients and their shared HTTP session"""
+        clients = list(self._clients.values())
+        if self._graph_client:
+            clients.append(self._graph_client)
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                self.logger.debug(f"Could not close client {client.__class__.__name__}: {e}")
+        self._clients = {}
+        self._graph_client = None
+
+        self._transport.close()
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_details) -> None:
+        self.close()
+
+    @property
+    def service_principal_credentials(self) -> ServicePrincipalCredentials:
+        """Legacy service principal credentials, only created when a client needs them.
+
+        Returns:
+            ServicePrincipalCredentials: credentials for the azure.common based clients
+        """
+        if not self._service_principal_credentials:
+            self._service_principal_credentials = ServicePrincipalCredentials(
+                client_id=self._get_client_id(), secret=self._get_client_secret(), tenant=self._get_tenant_id()
+            )
+        return self._service_principal_credentials
 
     def _load_azure_credential(self) -> dict:
         """Loads the azure identity file from the user's home folder (path is class variable).
+        The file is read once on init, getters use the parsed dict stored in `self._auth`.
 
         Returns:
             dict: the credential dict
         """
-        with open(self.azure_auth_path, "r") as file:
-            azure_json = json.load(file)
-        return azure_json
+        return json.loads(self.azure_auth_path.read_bytes())
 
     def _get_tenant_id(self) -> str:
         """Get the tenant ID for the service principal
@@ -67,11 +131,10 @@ class AzureApi:
         Returns:
             str: tenant ID
         """
-        azure_auth = self._load_azure_credential()
-        if "tenantId" in azure_auth:
-            return azure_auth["tenantId"]
+        if "tenantId" in self._auth:
+            return self._auth["tenantId"]
         else:
-            return azure_auth["tenant"]
+            return self._auth["tenant"]
 
     def _get_client_id(self) -> str:
         """Get the client ID
@@ -79,11 +142,10 @@ class AzureApi:
         Returns:
             str: Client ID
         """
-        azure_auth = self._load_azure_credential()
-        if "clientId" in azure_auth:
-            return azure_auth["clientId"]
+        if "clientId" in self._auth:
+            return self._auth["clientId"]
         else:
-            return azure_auth["appId"]
+            return self._auth["appId"]
 
     def _get_client_secret(self) -> str:
         """Get the service principal's secret
@@ -91,23 +153,25 @@ class AzureApi:
         Returns:
             str: Client secret
         """
-        azure_auth = self._load_azure_credential()
-        if "clientSecret" in azure_auth:
-            return azure_auth["clientSecret"]
+        if "clientSecret" in self._auth:
+            return self._auth["clientSecret"]
         else:
-            return azure_auth["password"]
+            return self._auth["password"]
 
     def _get_client_secret_credential(self, resource_id: str = None) -> ClientSecretCredential:
         """Get client secret credentials, which are mostly used with management clients.
+        Wrappers are cached per resource ID, so their token cache is reused.
 
         Returns:
             ClientSecretCredential: CS credentials to be used with clients
         """
-
-        if resource_id:
-            return CredentialWrapper(self.client_secret_credentials, resource_id=resource_id)
-        else:
-            return CredentialWrapper(self.client_secret_credentials)
+        if resource_id not in self._credential_wrappers:
+            if resource_id:
+                wrapper = CredentialWrapper(self.client_secret_credentials, resource_id=resource_id)
+            else:
+                wrapper = CredentialWrapper(self.client_secret_credentials)
+            self._credential_wrappers[resource_id] = wrapper
+        return self._credential_wrappers[resource_id]
 
     def _get_subscription_id(self) -> str:
         """Get the subscription ID string from auth file.
@@ -115,47 +179,68 @@ class AzureApi:
         Returns:
             str: Subscription ID on Azure
         """
-        return self._load_azure_credential()["subscriptionId"]
+        return self._auth["subscriptionId"]
+
+    def _get_graph_credentials(self) -> ServicePrincipalCredentials:
+        """Get the service principal credentials for the Graph API, created once on first use.
+
+        Returns:
+            ServicePrincipalCredentials: credentials with graph.windows.net resource
+        """
+        if not self._graph_credentials:
+            self._graph_credentials = ServicePrincipalCredentials(
+                client_id=self._get_client_id(),
+                secret=self._get_client_secret(),
+                tenant=self._get_tenant_id(),
+                resource="https://graph.windows.net",
+            )
+        return self._graph_credentials
+
+    def _get_graph_client(self) -> GraphRbacManagementClient:
+        """Get the Graph RBAC client, it is created on first use and kept open for later queries.
+
+        Returns:
+            GraphRbacManagementClient: Graph client of the tenant
+        """
+        if not self._graph_client:
+            self._graph_client = GraphRbacManagementClient(
+                self._get_graph_credentials(), self._get_tenant_id(), "https://graph.windows.net"
+            )
+            self._graph_client.config.keep_alive = True
+        return self._graph_client
 
     def get_object_id(self) -> str:
-        """Get the RBAC object ID
+        """Get the RBAC object ID of the service principal.
+        The ID does not change for a service principal, so it is queried only once.
+
+        Raises:
+            AzureError: If the service principal cannot be found.
 
         Returns:
             str: Object ID
         """
-        graphrbac_credentials = ServicePrincipalCredentials(
-            client_id=self._get_client_id(),
-            secret=self._get_client_secret(),
-            tenant=self._get_tenant_id(),
-            resource="https://graph.windows.net",
-        )
-        graphrbac_client = GraphRbacManagementClient(
-            graphrbac_credentials, self._get_tenant_id(), "https://graph.windows.net"
-        )
-        result = list(
-            graphrbac_client.service_principals.list(
-                filter="servicePrincipalNames/any(c:c eq '{}')".format(self._get_client_id())
-            )
-        )
-        assert len(result[0].object_id) > 0
-        return result[0].object_id
+        if not self._object_id:
+            service_principals = self._get_graph_client().service_principals.list(filter=self._graph_filter)
+            service_principal = next(iter(service_principals), None)
+            if service_principal is None or not service_principal.object_id:
+                raise AzureError("Service principal not found in Azure AD.")
+            self._object_id = service_principal.object_id
+        return self._object_id
 
     @staticmethod
     def _suppress_azure_internal_logs() -> None:
-        """Suppress Azure Python libraries internal verbose logs"""
-        logging.getLogger("azure").setLevel(logging.WARNING)
-        logging.getLogger("azure.core").setLevel(logging.WARNING)
-        logging.getLogger("adal-python").setLevel(logging.WARNING)
-        logging.getLogger("urllib3").setLevel(logging.WARNING)
-        logging.getLogger("msrest").setLevel(logging.WARNING)
-        logging.getLogger("msal").setLevel(logging.WARNING)
-        logging.getLogger("azure.storage").setLevel(logging.WARNING)
-        logging.getLogger("azure.identity").setLevel(logging.WARNING)
+        """Suppress Azure Python libraries internal verbose logs, only done once per process"""
+        if AzureApi._logs_suppressed:
+            return
+        for name in _SUPPRESSED_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+        AzureApi._logs_suppressed = True
 
     def client(self, client_class: Type[SDKClient]) -> SDKClient:
         """Get an Azure Management client by it's class using caching.
         All of these classes are inherited from SDKClient.
         If a class is requested multiple times, the same (cached) instance will be returned.
+        The azure-core based clients share one HTTP transport, so connections are pooled between them.
 
         Args:
             client_class (Type[SDKClient]): The client you want to use, for example ComputeManagementClient
@@ -163,12 +248,24 @@ class AzureApi:
         Returns:
             SDKClient: An object of the requested class is returned, and cached.
         """
-        if client_class.__name__ not in self._clients:
+        if client_class not in self._clients:
             self.logger.debug(f"Creating client: {client_class.__name__}")
 
-            # TODO as Azure moves, this should be changed to use the common auth from azure.identity
-            cred = self.credentials if client_class != StorageManagementClient else self.client_secret_credentials
-
-            self._clients[client_class.__name__] = client_class(cred, self.subscription_id)
-
-        return self._clients[client_class.__name__]
+            if issubclass(client_class, SDKClient):
+                # msrest based clients get the wrapped credentials and keep their own session open between calls
+                client = client_class(self.credentials, self.subscription_id)
+                client.config.keep_alive = True
+                client.config.long_running_operation_timeout = self.polling_interval
+            else:
+                # azure-core based clients use azure.identity credentials and the shared transport
+                client = client_class(
+                    self.client_secret_credentials,
+                    self.subscription_id,
+                    transport=self._transport,
+                    polling_interval=self.polling_interval,
+                    **self.retry_settings,
+                )
+
+            self._clients[client_class] = client
+
+        return self._clients[client_class]
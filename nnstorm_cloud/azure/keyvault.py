@@ -3,13 +3,14 @@ Module azure_api containing the AzureKeyVault class,
 which is responsible for Azure resource management and Azure client handling mechanism.
 """
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List
 
-from msrestazure.azure_exceptions import CloudError
-from nnstorm_cloud.azure.api import AzureApi
+from nnstorm_cloud.azure.api import AzureApi, AzureError
 
-from azure.keyvault.secrets import SecretClient
+from azure.core.exceptions import HttpResponseError, ServiceRequestError
+from azure.keyvault.secrets import ApiVersion, SecretClient
 from azure.mgmt.keyvault import KeyVaultManagementClient
 from azure.mgmt.keyvault.models import NetworkRuleSet, VaultCheckNameAvailabilityParameters, VirtualNetworkRule
 
@@ -29,13 +30,49 @@ class AzureKeyVault(AzureApi):
         self.name = keyvault_name
         self.uri = f"https://{self.name}.vault.azure.net"
 
-        self.secret_client = SecretClient(vault_url=self.uri, credential=self.client_secret_credentials, version="7.0")
-        self.keyvault_client = KeyVaultManagementClient(self.client_secret_credentials, self.subscription_id)
+        self.secret_client = SecretClient(
+            vault_url=self.uri,
+            credential=self.client_secret_credentials,
+            api_version=ApiVersion.V7_0,
+            transport=self._transport,
+            **self.retry_settings,
+        )
 
-        self.exists = self.name in [i.name for i in self.keyvault_client.vaults.list()]
+        self._exists = None
+        self._network_rules = {}
 
         self.logger.debug(f"Keyvault manager ready: {self.name}")
 
+    @property
+    def keyvault_client(self) -> KeyVaultManagementClient:
+        """Keyvault management client, created on first use as secret operations do not need it
+
+        Returns:
+            KeyVaultManagementClient: the cached management client
+        """
+        return self.client(KeyVaultManagementClient)
+
+    @property
+    def exists(self) -> bool:
+        """Whether the keyvault exists, looked up on first access with the name availability API.
+        The cached value is updated by create_keyvault and delete_keyvault.
+
+        Returns:
+            bool: True if the keyvault name is in use
+        """
+        if self._exists is None:
+            available = self.keyvault_client.vaults.check_name_availability(
+                VaultCheckNameAvailabilityParameters(name=self.name)
+            )
+            self.logger.debug("Keyvault name availability: %s", available)
+            self._exists = not available.name_available
+        return self._exists
+
+    def close(self) -> None:
+        """Close the secret client and the management clients"""
+        self.secret_client.close()
+        super(AzureKeyVault, self).close()
+
     def get_secret(self, name: str) -> str:
         """Get secret from keyvault
 
@@ -48,11 +85,24 @@ class AzureKeyVault(AzureApi):
         try:
             secret = self.secret_client.get_secret(name)
             self.logger.debug(f"Retrieved secret: {secret.id}")
-        except CloudError as e:
+        except HttpResponseError as e:
             self.logger.error(f"Could not get secret: {name}")
             raise e
         return secret.value
 
+    def get_secrets(self, names: List[str], max_workers: int = 8) -> List[str]:
+        """Get multiple secrets from keyvault with concurrent requests over the shared connection pool
+
+        Args:
+            names (List[str]): names of the secrets to get from keyvault
+            max_workers (int, optional): maximum number of parallel requests. Defaults to 8.
+
+        Returns:
+            List[str]: The secret values in the order of names
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.get_secret, names))
+
     def set_secret(self, name: str, value: str) -> str:
         """Set secret value in keyvault
 
@@ -63,7 +113,7 @@ class AzureKeyVault(AzureApi):
         try:
             secret = self.secret_client.set_secret(name, value)
             self.logger.debug(f"Set secret: {secret.id}")
-        except CloudError as e:
+        except HttpResponseError as e:
             self.logger.error(f"Could not set secret: {name}")
             raise e
         return secret.value
@@ -80,6 +130,23 @@ class AzureKeyVault(AzureApi):
         if purge:
             self.secret_client.purge_deleted_secret(name)
 
+    def _build_network_rules(self, subnet_ids: List[str]) -> NetworkRuleSet:
+        """Build the network rule set which only allows access from the given subnets.
+        Rule sets are cached per subnet list, so creating and granting access reuses them.
+
+        Args:
+            subnet_ids (List[str]): list of subnet IDs
+
+        Returns:
+            NetworkRuleSet: keyvault network ACLs
+        """
+        key = tuple(subnet_ids)
+        if key not in self._network_rules:
+            self._network_rules[key] = NetworkRuleSet(
+                default_action="Deny", ip_rules=[], virtual_network_rules=[VirtualNetworkRule(id=i) for i in subnet_ids]
+            )
+        return self._network_rules[key]
+
     def grant_access(self, rsg: str, subnet_ids: List[str] = None) -> None:
         """Grant access to a keyvault from a list of subnets
 
@@ -92,12 +159,9 @@ class AzureKeyVault(AzureApi):
 
         vault = self.keyvault_client.vaults.get(rsg, self.name)
         props = vault.properties
-        tenant_update = False
+        tenant_update = props.tenant_id != tenant_id or not any(x.tenant_id == tenant_id for x in props.access_policies)
 
-        if (
-            tenant_id not in [x.tenant_id for x in vault.properties.access_policies]
-        ) or vault.properties.tenant_id != tenant_id:
-            tenant_update = True
+        if tenant_update:
             props.tenant_id = tenant_id
             props.access_policies.append(
                 {
@@ -107,11 +171,7 @@ class AzureKeyVault(AzureApi):
                 }
             )
         if subnet_ids:
-            props.network_acls = NetworkRuleSet(
-                default_action="Deny",
-                ip_rules=[],
-                virtual_network_rules=[VirtualNetworkRule(id=i) for i in subnet_ids],
-            )
+            props.network_acls = self._build_network_rules(subnet_ids)
         if subnet_ids or tenant_update:
             kv = self.keyvault_client.vaults.create_or_update(
                 rsg,
@@ -138,33 +198,40 @@ class AzureKeyVault(AzureApi):
         except Exception as e:
             if not fail_ok:
                 raise e
-
-        self.exists = False
-
-    def create_keyvault(self, rsg: str, location: str, soft_delete: bool = True, subnet_ids: List[str] = None):
+            # the outcome is unknown, look it up again on the next access
+            self._exists = None
+        else:
+            self._exists = False
+
+    def create_keyvault(
+        self, rsg: str, location: str, soft_delete: bool = True, subnet_ids: List[str] = None, timeout: float = 300
+    ):
         """Creates a key vault object in Azure
 
         Args:
             soft_delete (bool, optional): turn on soft-delete. Defaults to True.
             subnet_ids (List[str], optional): subnet IDs to grant access to. Defaults to None.
+            timeout (float, optional): seconds to wait for the keyvault to become reachable. Defaults to 300.
 
         Raises:
             RuntimeError: Keyvault name is already taken.
+            AzureError: Keyvault is not reachable within the timeout.
         """
         self.logger.info(f"Create or update KeyVault running for: {self.name}")
 
         if not self.check_name_available():
             raise RuntimeError("Keyvault name is taken by deleted keyvault or is being used.")
 
+        tenant_id = self._get_tenant_id()
         configuration = {
             "location": location,
             "properties": {
                 "sku": {"name": "standard", "family": "A"},
-                "tenant_id": self._get_tenant_id(),
+                "tenant_id": tenant_id,
                 "enable_soft_delete": soft_delete,
                 "access_policies": [
                     {
-                        "tenant_id": self._get_tenant_id(),
+                        "tenant_id": tenant_id,
                         "object_id": self.get_object_id(),
                         "permissions": {"keys": ["all"], "secrets": ["all", "purge"]},
                     }
@@ -173,24 +240,26 @@ class AzureKeyVault(AzureApi):
         }
 
         if subnet_ids:
-            configuration["properties"]["network_acls"] = NetworkRuleSet(
-                default_action="Deny", ip_rules=[], virtual_network_rules=[VirtualNetworkRule(id=i) for i in subnet_ids]
-            )
+            configuration["properties"]["network_acls"] = self._build_network_rules(subnet_ids)
 
         kv = self.keyvault_client.vaults.begin_create_or_update(rsg, self.name, configuration)
         kv.wait()
 
-        while True:
+        delay, deadline = 1.0, time.monotonic() + timeout
+        while time.monotonic() < deadline:
             try:
                 self.set_secret("test", "x")
-            except:
+            except (HttpResponseError, ServiceRequestError):
                 self.logger.warning("Waiting for keyvault to come up. Please check connection to the VNET.")
-                time.sleep(1)
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
             else:
                 self.delete_secret("test")
                 break
+        else:
+            raise AzureError(f"Keyvault {self.name} is not reachable after {timeout}s.")
 
-        self.exists = True
+        self._exists = True
 
     def check_name_available(self) -> bool:
         """Check if keyvault name is available
@@ -202,15 +271,20 @@ class AzureKeyVault(AzureApi):
             bool: whether the name is available or not
         """
 
-        deleted_vaults = self.keyvault_client.vaults.list_deleted()
-        names = [i.name for i in deleted_vaults]
-        print(names)
+        if self._exists is None:
+            # the two lookups are independent, run them concurrently
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                exists = executor.submit(lambda: self.exists)
+                deleted = executor.submit(self._is_deleted)
+                return not (exists.result() or deleted.result())
 
-        available = self.keyvault_client.vaults.check_name_availability(
-            VaultCheckNameAvailabilityParameters(name=self.name)
-        )
-        print(available)
+        return not (self.exists or self._is_deleted())
+
+    def _is_deleted(self) -> bool:
+        """Check if the keyvault name belongs to a soft-deleted keyvault
 
-        if (self.name in names) or not available.name_available:
-            return False
-        return True
+        Returns:
+            bool: whether the name is among the deleted keyvaults
+        """
+        # only page through the deleted vaults until the name is found
+        return any(i.name == self.name for i in self.keyvault_client.vaults.list_deleted())
@@ -2,16 +2,20 @@
 Module azure_api containing the AzureManager class,
 which is responsible for Azure resource management and Azure client handling mechanism.
 """
-import random
+import secrets
 import string
-import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
-from msrestazure.azure_exceptions import CloudError
+from msrest.polling import LROPoller
 from nnstorm_cloud.azure.api import AzureApi, AzureError
-from nnstorm_cloud.core.utils import run_shell_command
+from nnstorm_cloud.azure.templates import VM_STACK_TEMPLATE
+from nnstorm_cloud.core.utils import replace_file
+import yaml
 
 from azure.mgmt.compute import ComputeManagementClient
 from azure.mgmt.compute.models import (
@@ -24,29 +28,97 @@ from azure.mgmt.compute.models import (
     VirtualMachineEvictionPolicyTypes,
     VirtualMachinePriorityTypes,
 )
+from azure.mgmt.containerservice import ContainerServiceClient
 from azure.mgmt.dns import DnsManagementClient
+from azure.mgmt.dns.models import ARecord as DnsARecord
+from azure.mgmt.dns.models import RecordSet as DnsRecordSet
 from azure.mgmt.network import NetworkManagementClient
 from azure.mgmt.network.models import (
     NetworkInterface,
     NetworkSecurityGroup,
     PublicIPAddress,
     PublicIPAddressDnsSettings,
+    SecurityRule,
     Subnet,
     VirtualNetwork,
 )
 from azure.mgmt.privatedns import PrivateDnsManagementClient
 from azure.mgmt.privatedns.models import ARecord, PrivateZone, RecordSet, VirtualNetworkLink
 from azure.mgmt.resource import ResourceManagementClient
+from azure.mgmt.resource.resources.models import Deployment, DeploymentMode, DeploymentProperties
 from azure.mgmt.storage import StorageManagementClient
 from azure.mgmt.storage.models import NetworkRuleSet
 from azure.mgmt.storage.models import Sku as StorageSku
 from azure.mgmt.storage.models import (
+    StorageAccount,
     StorageAccountCheckNameAvailabilityParameters,
     StorageAccountCreateParameters,
     VirtualNetworkRule,
 )
 from azure.storage.file import FileService
 
+# ssh, alternative ssh, tensorboard, jupyter and http ports opened by the development security rule
+_DEV_PORT_RANGES = ("22", "20022", "6006", "6666", "8888", "8889", "6007", "80", "8080")
+
+# security rule parameters without the source address, which is set per rule
+_DEV_PORTS_RULE = {
+    "protocol": "Tcp",
+    "source_port_range": "*",
+    "destination_port_ranges": _DEV_PORT_RANGES,
+    "destination_address_prefix": "*",
+    "priority": 200,
+    "direction": "Inbound",
+    "access": "Allow",
+}
+_PING_RULE = {
+    "protocol": "ICMP",
+    "source_port_range": "*",
+    "destination_port_range": "*",
+    "destination_address_prefix": "*",
+    "priority": 100,
+    "direction": "Inbound",
+    "access": "Allow",
+}
+
+
+def _initial_resource(handle: Any) -> Any:
+    """The resource returned by the request which started a long running operation, without waiting for it.
+    It describes the resource in its current provisioning state, so no extra GET is needed to get it.
+
+    Args:
+        handle (Any): poller of the operation
+
+    Returns:
+        Any: the deserialized resource, None if the response had no body or the poller does not keep it
+    """
+    polling_method = handle.polling_method()
+    try:
+        # the current response of the polling method can be an operation status, the initial one is the resource
+        return polling_method._parse_resource(polling_method._initial_response)
+    except AttributeError:
+        return None
+
+
+def _merge_kubeconfig(kubeconfig: dict, cluster_config: dict) -> dict:
+    """Merge the kubeconfig of a cluster into an existing kubeconfig and switch to its context.
+    Clusters, users and contexts with the same name are replaced, the other entries are kept.
+
+    Args:
+        kubeconfig (dict): the existing kubeconfig, it is updated in place
+        cluster_config (dict): the kubeconfig of the cluster
+
+    Returns:
+        dict: the merged kubeconfig
+    """
+    for section in ("clusters", "users", "contexts"):
+        entries = {entry["name"]: entry for entry in kubeconfig.get(section) or []}
+        entries.update((entry["name"], entry) for entry in cluster_config.get(section) or [])
+        kubeconfig[section] = list(entries.values())
+    kubeconfig.setdefault("apiVersion", cluster_config.get("apiVersion", "v1"))
+    kubeconfig.setdefault("kind", "Config")
+    kubeconfig["current-context"] = cluster_config["current-context"]
+    return kubeconfig
+
 
 class AzureManager(AzureApi):
     """Azure Python API wrapper to help with common Azure tasks for VMs and deployments
@@ -79,23 +151,43 @@ class AzureManager(AzureApi):
         super(AzureManager, self).__init__(auth_path)
 
         self._async_mode = async_mode
+        # pending handles of the open bulk() blocks, innermost last, and the blocks opened by each thread
+        self._bulk_blocks: List[List[Any]] = []
+        self._bulk_lock = threading.Lock()
+        self._bulk_local = threading.local()
 
         self.config = {}
         self.rsg = rsg
+        self._sub_prefix = f"/subscriptions/{self.subscription_id}"
+        self._rsg_id = f"{self._sub_prefix}/resourceGroups/{rsg}"
+        # known only after creating the resource group, otherwise looked up from the existing one on first use
+        self._location = None
+        self._existing = {}
+        self._existing_locks = {}
+        self._existing_locks_lock = threading.Lock()
+        # set when this manager created the resource group, so it cannot contain resources yet
+        self._empty_rsg = False
+        self._file_services = {}
+        self._vnet_ids = {}
+        self._cluster_net = {}
 
         # create or update resource group if does not exist:
         if create_rsg:
-            self.client(ResourceManagementClient).resource_groups.create_or_update(self.rsg, {"location": location})
-
-            while True:
-                time.sleep(0.5)
-                rsg_state = (
-                    self.client(ResourceManagementClient).resource_groups.get(self.rsg).properties.provisioning_state
-                )
-                if rsg_state == "Succeeded":
-                    break
-
+            resource_groups = self.client(ResourceManagementClient).resource_groups
+            # the PUT returns the resource group, poll only while it is not provisioned yet
+            response = resource_groups.create_or_update(self.rsg, {"location": location}, raw=True)
+            resource_group = response.output
+            self._empty_rsg = response.response.status_code == 201
+
+            delay, deadline = 1.0, time.monotonic() + 300
+            while resource_group.properties.provisioning_state != "Succeeded":
+                if time.monotonic() > deadline:
+                    raise AzureError(f"Resource group {self.rsg} was not provisioned in time.")
                 self.logger.info("Waiting for RSG to be available.")
+                time.sleep(delay)
+                delay = min(delay * 2, 15)
+                resource_group = resource_groups.get(self.rsg)
+            self._location = resource_group.location
 
         self.logger.debug("Azure Manager API init completed.")
 
@@ -107,17 +199,100 @@ class AzureManager(AzureApi):
         """
         self._async_mode = async_on
 
-    def _async_wait(self, handle, force_wait=False) -> None:
-        """If async mode is turned on, proceed, otherwise wait for handle's completion
+    def _async_wait(self, handle, force_wait=False) -> Any:
+        """If async mode is turned on, proceed, otherwise wait for handle's completion.
+        Inside a bulk() block the handle is collected and waited for at the end of the block.
+        The poller drives the waiting, so the polling interval suggested by Azure is respected.
 
         Args:
             handle {azure job handle}: Azure job handler (like process), for which to wait
             force_wait (bool, optional): If set, wait is enforced disregarding object setting. Defaults to False.
+
+        Returns:
+            Any: the result of the operation if it was waited for, otherwise the resource returned when the
+                operation was started (None if it returned none)
         """
-        if not self._async_mode or force_wait:
-            handle.wait()
+        pending = self._pending_handles()
+        if pending is not None and not force_wait:
+            pending.append(handle)
+        elif not self._async_mode or force_wait:
+            # result() raises if the operation failed, wait() would not
+            return handle.result()
         else:
             self.logger.debug("Request successful, async operation in progress")
+        return _initial_resource(handle)
+
+    def _pending_handles(self) -> Optional[List[Any]]:
+        """The pending handles of the innermost bulk() block opened by the current thread.
+        Helpers running in worker threads inside a block use the innermost block of the manager.
+
+        Returns:
+            Optional[List[Any]]: the pending handles, None outside bulk() blocks
+        """
+        blocks = getattr(self._bulk_local, "blocks", None)
+        if blocks:
+            return blocks[-1]
+        with self._bulk_lock:
+            return self._bulk_blocks[-1] if self._bulk_blocks else None
+
+    @contextmanager
+    def bulk(self):
+        """Context manager to create independent resources concurrently.
+        Long running operations started in the block do not block each other,
+        all of them are waited for when the block exits. Blocks can be nested,
+        each one waits for the operations started in it.
+
+        Example:
+            with manager.bulk():
+                nsg = manager.network_security_group("nsg")
+                public_ip = manager.public_ip("ip")
+        """
+        pending = []
+        if not hasattr(self._bulk_local, "blocks"):
+            self._bulk_local.blocks = []
+        self._bulk_local.blocks.append(pending)
+        with self._bulk_lock:
+            self._bulk_blocks.append(pending)
+        try:
+            yield self
+            # pollers run in their own threads, waiting in sequence takes as long as the slowest one
+            for handle in pending:
+                handle.result()
+        finally:
+            self._bulk_local.blocks.pop()
+            with self._bulk_lock:
+                # blocks of other threads may have been opened since, remove this one by identity
+                del self._bulk_blocks[next(i for i, block in enumerate(self._bulk_blocks) if block is pending)]
+
+    def _existing_resources(self, kind: str, list_operation: Callable, *parents: str) -> Dict[str, Any]:
+        """Get the existing resources of a kind in the resource group by name.
+        Resources are listed once per kind and parent, the helpers keep the cache up to date.
+        Nothing is listed in a resource group which was just created by the manager.
+
+        Args:
+            kind (str): resource kind, used as cache key
+            list_operation (Callable): list operation of the management client for the resource kind
+            parents (str): names of the parent resources, like the vnet of subnets
+
+        Returns:
+            Dict[str, Any]: the listed resources by name
+        """
+        key = (kind,) + parents
+        existing = self._existing.get(key)
+        if existing is None:
+            # helpers run in parallel threads, the first one lists the resources and the others wait for it
+            with self._existing_locks_lock:
+                key_lock = self._existing_locks.setdefault(key, threading.Lock())
+            with key_lock:
+                existing = self._existing.get(key)
+                if existing is None:
+                    if self._empty_rsg:
+                        listing = {}
+                    else:
+                        listing = {resource.name: resource for resource in list_operation(self.rsg, *parents)}
+                    # publish atomically, a listing stored after a cache reset in the meantime wins
+                    existing = self._existing.setdefault(key, listing)
+        return existing
 
     def virtual_machine(
         self,
@@ -152,57 +327,104 @@ class AzureManager(AzureApi):
         Returns:
             VirtualMachine: The created virtual machine's descriptor.
         """
-        try:
-            vm = self.client(ComputeManagementClient).virtual_machines.get(self.rsg, name)
-        except CloudError:
-            if not network_interface:
-                raise AzureError("Cannot create VM without network interface, please supply it.")
+        create_vm = self.vm_template(
+            image=image,
+            size=size,
+            user=user,
+            password=password,
+            spot_instance=spot_instance,
+            max_price_per_hour=max_price_per_hour,
+            disk_size_gb=disk_size_gb,
+            ssh_pubkey=ssh_pubkey,
+        )
+        return create_vm(name, network_interface)
 
-            self.logger.info(f"Creating virtual machine: {name}")
-        else:
-            self.logger.info(f"Found virtual machine: {name}")
-            return vm
+    def vm_template(
+        self,
+        image: dict = None,
+        size: str = "Standard_B2s",
+        user: str = None,
+        password: str = None,
+        spot_instance: bool = True,
+        max_price_per_hour: float = 2.0,
+        disk_size_gb: int = 32,
+        ssh_pubkey: str = None,
+    ) -> Callable[[str, NetworkInterface], VirtualMachine]:
+        """Prebuild the parameters of virtual machines which differ only in their name and network interface.
+        The returned function works like `virtual_machine`, the shared parts of the parameters are built once.
 
-        vm_params = {
-            "location": self.config["location"],
-            "os_profile": {"computer_name": name, "admin_username": user, "admin_password": password},
+        Args:
+            image (dict, optional): image description to use. Defaults to None.
+            size (str, optional): size of the VM. Defaults to "Standard_B2s".
+            user (str, optional): default username. Defaults to None.
+            password (str, optional): user's password. Defaults to None.
+            spot_instance (bool, optional): Whether to deploy a spot / pay as you go instance. Defaults to True.
+            max_price_per_hour (float, optional): Max price/hour in euros. Defaults to 2.0.
+            disk_size_gb (int, optional): Size of the OS disk. Defaults to 32.
+            ssh_pubkey (str, optional): SSH public key for logging in as user. Defaults to None.
+
+        Returns:
+            Callable[[str, NetworkInterface], VirtualMachine]: gets / creates a VM by name and network interface
+        """
+        os_profile = {"admin_username": user, "admin_password": password}
+        base_params = {
             "hardware_profile": {
                 "vm_size": size,
                 "os_disk": OSDisk(disk_size_gb=disk_size_gb, create_option="FromImage"),
             },
             "storage_profile": {"image_reference": image},
-            "network_profile": {"network_interfaces": [network_interface]},
             "tags": {"persistent": "0", "development": "1"},
-            "plan": self.config["nvidia_plan"],
         }
 
         if spot_instance:
             # use Azure spot instance
-            vm_params["priority"] = VirtualMachinePriorityTypes.spot
+            base_params["priority"] = VirtualMachinePriorityTypes.spot
             # For Azure Spot virtual machines, the only supported value is 'Deallocate'
-            vm_params["eviction_policy"] = VirtualMachineEvictionPolicyTypes.deallocate
+            base_params["eviction_policy"] = VirtualMachineEvictionPolicyTypes.deallocate
             # set max price
-            vm_params["billing_profile"] = BillingProfile(max_price=max_price_per_hour)
+            base_params["billing_profile"] = BillingProfile(max_price=max_price_per_hour)
 
         if ssh_pubkey:
             key_path = f"/home/{user}/.ssh/authorized_keys"
             pubkey = SshPublicKey(path=key_path, key_data=ssh_pubkey)
-            vm_params["os_profile"]["linux_configuration"] = LinuxConfiguration(
-                ssh=SshConfiguration(public_keys=[pubkey])
-            )
+            os_profile["linux_configuration"] = LinuxConfiguration(ssh=SshConfiguration(public_keys=[pubkey]))
 
-        self.logger.info(f"Creating VM:  {name}")
+        def create_vm(name: str, network_interface: NetworkInterface = None) -> VirtualMachine:
+            compute = self.client(ComputeManagementClient)
 
-        vm_job = self.client(ComputeManagementClient).virtual_machines.create_or_update(self.rsg, name, vm_params)
-        self._async_wait(vm_job)
+            existing = self._existing_resources("vm", compute.virtual_machines.list)
+            if name in existing:
+                self.logger.info("Found virtual machine: %s", name)
+                return existing[name]
 
-        vm = self.client(ComputeManagementClient).virtual_machines.get(self.rsg, name)
+            if not network_interface:
+                raise AzureError("Cannot create VM without network interface, please supply it.")
+
+            self.logger.info("Creating virtual machine: %s", name)
+
+            # only the per VM parts are new, the rest of the parameters is shared between the VMs,
+            # the config is read only here, so existing VMs can be looked up without a location configured
+            vm_params = dict(
+                base_params,
+                location=self.config["location"],
+                # the marketplace plan is optional, an empty one is left out like in the VM stack template
+                plan=self.config.get("nvidia_plan") or None,
+                os_profile=dict(os_profile, computer_name=name),
+                network_profile={"network_interfaces": [network_interface]},
+            )
 
-        self.logger.info(f"Created VM: {vm.name}")
-        return vm
+            vm_job = compute.virtual_machines.begin_create_or_update(self.rsg, name, vm_params)
+            vm = self._async_wait(vm_job) or compute.virtual_machines.get(self.rsg, name)
+            existing[name] = vm
+
+            self.logger.info("Created VM: %s", vm.name)
+            return vm
+
+        return create_vm
 
     def delete(self, resource: object) -> None:
         """Delete resource from Azure
+        The managed disks of a virtual machine are deleted together with it, as Azure keeps them otherwise.
 
         Args:
             resource (object): An existing Azure resource.
@@ -210,41 +432,105 @@ class AzureManager(AzureApi):
         Raises:
             AzureError: If resource object does not have delete functionality
         """
-        self.logger.info("Delete {resource.__class__.__name__}: {resource.name}")
+        self.logger.info("Delete %s: %s", resource.__class__.__name__, resource.name)
 
         if isinstance(resource, VirtualMachine):
-            async_delete = self.client(ComputeManagementClient).virtual_machines.delete(self.rsg, resource.name)
-            async_delete.wait()
+            compute = self.client(ComputeManagementClient)
+
+            storage_profile = resource.storage_profile
+            disks = [storage_profile.os_disk] + list(storage_profile.data_disks or []) if storage_profile else []
+            # disk IDs look like /subscriptions/<id>/resourceGroups/<rsg>/providers/Microsoft.Compute/disks/<name>
+            disk_ids = [
+                disk.managed_disk.id.split("/") for disk in disks if disk and disk.managed_disk and disk.managed_disk.id
+            ]
+
+            async_delete = compute.virtual_machines.begin_delete(self.rsg, resource.name)
+            self._async_wait(async_delete, force_wait=True)
+            self._existing.get(("vm",), {}).pop(resource.name, None)
+
+            # disks can be deleted once the VM is gone, start all of them before waiting
+            disk_deletes = [compute.disks.begin_delete(disk_id[4], disk_id[-1]) for disk_id in disk_ids]
+            for disk_delete in disk_deletes:
+                self._async_wait(disk_delete)
         else:
             raise AzureError(f"Object's class is unknown to delete functionality.")
 
-    def network_security_group(self, name: str) -> NetworkSecurityGroup:
+    def network_security_group(self, name: str, rules: Dict[str, dict] = None) -> NetworkSecurityGroup:
         """Get existing / create new network security group
+        A new NSG is created together with its rules in one request, rules are merged into an existing NSG.
 
         Args:
             name (str): name of the NSG
+            rules (Dict[str, dict], optional): security rule parameters by rule name. Defaults to None.
 
         Returns:
             NetworkSecurityGroup: The created / existing NSG's Azure API object
         """
-        # get resource if exists
-        try:
-            nsg = self.client(NetworkManagementClient).network_security_groups.get(self.rsg, name)
-        except CloudError:
-            self.logger.info(f"Creating or updating nsg: {name}")
-        else:
-            self.logger.debug(f"Found network security group: {name}")
-            return nsg
+        netclient = self.client(NetworkManagementClient)
 
-        nsg_job = self.client(NetworkManagementClient).network_security_groups.create_or_update(
-            self.rsg, name, {"location": self.get_location()}
+        # get resource if exists
+        existing = self._existing_resources("nsg", netclient.network_security_groups.list)
+        if name in existing:
+            self.logger.debug("Found network security group: %s", name)
+            if rules:
+                self.apply_nsg_rules(existing[name], rules)
+            return existing[name]
+
+        self.logger.info("Creating or updating nsg: %s", name)
+
+        params = NetworkSecurityGroup(
+            location=self.get_location(),
+            security_rules=[SecurityRule(name=rule_name, **rule) for rule_name, rule in (rules or {}).items()],
         )
-        self._async_wait(nsg_job)
-
-        nsg = self.client(NetworkManagementClient).network_security_groups.get(self.rsg, name)
+        nsg_job = netclient.network_security_groups.begin_create_or_update(self.rsg, name, params)
+        nsg = self._async_wait(nsg_job) or netclient.network_security_groups.get(self.rsg, name)
+        existing[name] = nsg
 
         return nsg
 
+    @staticmethod
+    def _dev_ports_rule(from_ip: str = "*") -> dict:
+        """Security rule parameters which allow development related ports
+
+        Args:
+            from_ip (str, optional): The source ip, by default can be any. Defaults to "*".
+
+        Returns:
+            dict: security rule parameters
+        """
+        return dict(_DEV_PORTS_RULE, source_address_prefix=from_ip)
+
+    @staticmethod
+    def _ping_rule(from_ip: str = "*") -> dict:
+        """Security rule parameters which allow ping
+
+        Args:
+            from_ip (str, optional): The source ip, by default can be any. Defaults to "*".
+
+        Returns:
+            dict: security rule parameters
+        """
+        return dict(_PING_RULE, source_address_prefix=from_ip)
+
+    def apply_nsg_rules(self, nsg: NetworkSecurityGroup, rules: Dict[str, dict]) -> None:
+        """Create or update several security rules of a network security group with a single request.
+        The rules are added to the current rules of the NSG, rules with the same name are replaced.
+
+        Args:
+            nsg (NetworkSecurityGroup): NSG in which to set the rules
+            rules (Dict[str, dict]): security rule parameters by rule name
+        """
+        netclient = self.client(NetworkManagementClient)
+
+        nsg = netclient.network_security_groups.get(self.rsg, nsg.name)
+        security_rules = [rule for rule in nsg.security_rules or [] if rule.name not in rules]
+        security_rules.extend(SecurityRule(name=name, **params) for name, params in rules.items())
+        nsg.security_rules = security_rules
+
+        nsg_job = netclient.network_security_groups.begin_create_or_update(self.rsg, nsg.name, nsg)
+        # keep the cached NSG in sync with its rules
+        self._existing.get(("nsg",), {})[nsg.name] = self._async_wait(nsg_job) or nsg
+
     def allow_nsg_development(self, nsg: NetworkSecurityGroup, from_ip: str = "*") -> None:
         """Allow development related ports in a given network security group
 
@@ -252,24 +538,9 @@ class AzureManager(AzureApi):
             nsg (NetworkSecurityGroup): NSG in which to enable dev ports
             from_ip (str, optional): The source ip, by default can be any. Defaults to "*".
         """
-        self.logger.info(f"Enabling ssh in network security group: {nsg.name}")
-        params = {
-            "protocol": "Tcp",
-            "source_port_range": "*",
-            "destination_port_ranges": ["22", "20022", "6006", "6666", "8888", "8889", "6007", "80", "8080"],
-            "source_address_prefix": from_ip,
-            "destination_address_prefix": "*",
-            "priority": 200,
-            "direction": "Inbound",
-            "access": "Allow",
-        }
-
-        security_rule_job = self.client(NetworkManagementClient).security_rules.create_or_update(
-            self.rsg, nsg.name, "dev_ports", params
-        )
-        self._async_wait(security_rule_job)
-
-        self.logger.info(f"Enabled ssh in network security group: {nsg.name}")
+        self.logger.info("Enabling ssh in network security group: %s", nsg.name)
+        self.apply_nsg_rules(nsg, {"dev_ports": self._dev_ports_rule(from_ip)})
+        self.logger.info("Enabled ssh in network security group: %s", nsg.name)
 
     def allow_nsg_ping(self, nsg: NetworkSecurityGroup, from_ip: str = "*") -> None:
         """Allow ping in a given network security group
@@ -278,24 +549,32 @@ class AzureManager(AzureApi):
             nsg (NetworkSecurityGroup): NSG in which to enable ping
             from_ip (str, optional): The source ip, by default can be any. Defaults to "*".
         """
-        self.logger.info(f"Enabling ping in network security group: {nsg.name}")
-        params = {
-            "protocol": "ICMP",
-            "source_port_range": "*",
-            "destination_port_range": "*",
-            "source_address_prefix": from_ip,
-            "destination_address_prefix": "*",
-            "priority": 100,
-            "direction": "Inbound",
-            "access": "Allow",
-        }
+        self.logger.info("Enabling ping in network security group: %s", nsg.name)
+        self.apply_nsg_rules(nsg, {"ping_rule": self._ping_rule(from_ip)})
+        self.logger.info("Enabled ping in network security group: %s", nsg.name)
 
-        security_rule_job = self.client(NetworkManagementClient).security_rules.create_or_update(
-            self.rsg, nsg.name, "ping_rule", params
-        )
-        self._async_wait(security_rule_job)
+    @classmethod
+    def development_rules(cls, from_ip: str = "*") -> Dict[str, dict]:
+        """Security rules which allow development related ports and ping
+
+        Args:
+            from_ip (str, optional): The source ip, by default can be any. Defaults to "*".
 
-        self.logger.info(f"Enabled ping in network security group: {nsg.name}")
+        Returns:
+            Dict[str, dict]: security rule parameters by rule name
+        """
+        return {"dev_ports": cls._dev_ports_rule(from_ip), "ping_rule": cls._ping_rule(from_ip)}
+
+    def allow_nsg_development_and_ping(self, nsg: NetworkSecurityGroup, from_ip: str = "*") -> None:
+        """Allow development related ports and ping in a given network security group with one request
+
+        Args:
+            nsg (NetworkSecurityGroup): NSG in which to enable dev ports and ping
+            from_ip (str, optional): The source ip, by default can be any. Defaults to "*".
+        """
+        self.logger.info("Enabling ssh and ping in network security group: %s", nsg.name)
+        self.apply_nsg_rules(nsg, self.development_rules(from_ip))
+        self.logger.info("Enabled ssh and ping in network security group: %s", nsg.name)
 
     def virtual_network(self, name: str, address_prefixes: List[str] = None) -> VirtualNetwork:
         """Get existing / create new virtual network with given address prefixes.
@@ -310,13 +589,14 @@ class AzureManager(AzureApi):
         Returns:
             VirtualNetwork: The created vnet's Azure API object
         """
-        try:
-            vnet = self.client(NetworkManagementClient).virtual_networks.get(self.rsg, name)
-        except CloudError:
-            self.logger.info(f"Creating or updating virtual network: {name}")
-        else:
-            self.logger.debug(f"Found virtual network: {name}")
-            return vnet
+        netclient = self.client(NetworkManagementClient)
+
+        existing = self._existing_resources("vnet", netclient.virtual_networks.list)
+        if name in existing:
+            self.logger.debug("Found virtual network: %s", name)
+            return existing[name]
+
+        self.logger.info("Creating or updating virtual network: %s", name)
 
         if not address_prefixes:
             raise AzureError("Cannot create vnet without specified address prefix.")
@@ -326,14 +606,11 @@ class AzureManager(AzureApi):
             "address_space": {"address_prefixes": address_prefixes},
         }
 
-        async_vnet_creation = self.client(NetworkManagementClient).virtual_networks.create_or_update(
-            self.rsg, name, vnet_config
-        )
-        self._async_wait(async_vnet_creation)
-
-        vnet = self.client(NetworkManagementClient).virtual_networks.get(self.rsg, name)
+        async_vnet_creation = netclient.virtual_networks.begin_create_or_update(self.rsg, name, vnet_config)
+        vnet = self._async_wait(async_vnet_creation) or netclient.virtual_networks.get(self.rsg, name)
+        existing[name] = vnet
 
-        self.logger.info(f"Created vnet: {name}")
+        self.logger.info("Created vnet: %s", name)
         return vnet
 
     def subnet(
@@ -357,13 +634,14 @@ class AzureManager(AzureApi):
         Returns:
             Subnet: The created / already existing subnetwork.
         """
-        try:
-            subnet = self.client(NetworkManagementClient).subnets.get(self.rsg, vnet.name, name)
-        except CloudError:
-            self.logger.info(f"Creating or updating subnet: {name}")
-        else:
-            self.logger.debug(f"Found subnet: {name}")
-            return subnet
+        netclient = self.client(NetworkManagementClient)
+
+        existing = self._existing_resources("subnet", netclient.subnets.list, vnet.name)
+        if name in existing:
+            self.logger.debug("Found subnet: %s", name)
+            return existing[name]
+
+        self.logger.info("Creating or updating subnet: %s", name)
 
         if not address_prefix:
             raise AzureError("Cannot create vnet without specified address prefix.")
@@ -375,15 +653,11 @@ class AzureManager(AzureApi):
         if nsg:
             subnet_config["network_security_group"] = nsg
 
-        async_subnet_creation = self.client(NetworkManagementClient).subnets.create_or_update(
-            self.rsg, vnet.name, name, subnet_config
-        )
-
-        self._async_wait(async_subnet_creation)
-
-        subnet = self.client(NetworkManagementClient).subnets.get(self.rsg, vnet.name, name)
+        async_subnet_creation = netclient.subnets.begin_create_or_update(self.rsg, vnet.name, name, subnet_config)
+        subnet = self._async_wait(async_subnet_creation) or netclient.subnets.get(self.rsg, vnet.name, name)
+        existing[name] = subnet
 
-        self.logger.info(f"Created subnet: {name}")
+        self.logger.info("Created subnet: %s", name)
         return subnet
 
     def public_ip(self, name: str, dns_name: str = None) -> PublicIPAddress:
@@ -399,14 +673,15 @@ class AzureManager(AzureApi):
         if not dns_name:
             dns_name = name
 
+        netclient = self.client(NetworkManagementClient)
+
         # get resource if exists
-        try:
-            public_ip = self.client(NetworkManagementClient).public_ip_addresses.get(self.rsg, name)
-        except CloudError:
-            self.logger.info(f"Creating or updating Public IP: {name}")
-        else:
-            self.logger.debug(f"Found public IP: {name}")
-            return public_ip
+        existing = self._existing_resources("public_ip", netclient.public_ip_addresses.list)
+        if name in existing:
+            self.logger.debug("Found public IP: %s", name)
+            return existing[name]
+
+        self.logger.info("Creating or updating Public IP: %s", name)
 
         params = {
             "location": self.get_location(),
@@ -418,12 +693,11 @@ class AzureManager(AzureApi):
             params["dns_settings"] = PublicIPAddressDnsSettings(domain_name_label=dns_name)
 
         self.logger.info("Creating public IP")
-        ip_job = self.client(NetworkManagementClient).public_ip_addresses.create_or_update(self.rsg, name, params)
-        self._async_wait(ip_job)
-
-        public_ip = self.client(NetworkManagementClient).public_ip_addresses.get(self.rsg, name)
+        ip_job = netclient.public_ip_addresses.begin_create_or_update(self.rsg, name, params)
+        public_ip = self._async_wait(ip_job) or netclient.public_ip_addresses.get(self.rsg, name)
+        existing[name] = public_ip
 
-        self.logger.info(f"Created public IP: {name}")
+        self.logger.info("Created public IP: %s", name)
         return public_ip
 
     def network_interface(
@@ -448,12 +722,11 @@ class AzureManager(AzureApi):
         netclient = self.client(NetworkManagementClient)
 
         # get resource if exists
-        try:
-            nic = netclient.network_interfaces.get(self.rsg, name)
-        except CloudError:
-            self.logger.info(f"Creating or updating NIC: {name}")
-        else:
-            return nic
+        existing = self._existing_resources("nic", netclient.network_interfaces.list)
+        if name in existing:
+            return existing[name]
+
+        self.logger.info("Creating or updating NIC: %s", name)
 
         if_config = {
             "location": self.config["location"],
@@ -466,41 +739,290 @@ class AzureManager(AzureApi):
         if public_ip:
             if_config["ip_configurations"][0]["public_ip_address"] = public_ip
 
-        async_nic_creation = netclient.network_interfaces.create_or_update(self.rsg, name, if_config)
-        self._async_wait(async_nic_creation)
-
-        nic = netclient.network_interfaces.get(self.rsg, name)
+        async_nic_creation = netclient.network_interfaces.begin_create_or_update(self.rsg, name, if_config)
+        nic = self._async_wait(async_nic_creation) or netclient.network_interfaces.get(self.rsg, name)
+        existing[name] = nic
 
-        self.logger.info(f"Created network interface: {name}")
+        self.logger.info("Created network interface: %s", name)
         return nic
 
-    def list_vms(self) -> List[VirtualMachine]:
+    def provision_vm_stack(
+        self,
+        nsg_name: str,
+        vnet_name: str,
+        vnet_addresses: List[str],
+        subnet_name: str,
+        subnet_address: str,
+        public_ip_name: str,
+        nic_name: str,
+        allow_development: bool = True,
+    ) -> NetworkInterface:
+        """Create the network resources of a virtual machine, following their dependencies.
+        The NSG, the virtual network and the public IP are independent and created concurrently,
+        the subnet and the network interface wait only for the resources they depend on.
+
+        Args:
+            nsg_name (str): network security group name
+            vnet_name (str): virtual network name
+            vnet_addresses (List[str]): virtual network address prefixes
+            subnet_name (str): subnetwork name
+            subnet_address (str): subnetwork address prefix
+            public_ip_name (str): public IP address name
+            nic_name (str): network interface name
+            allow_development (bool, optional): open the development ports and ping on the NSG. Defaults to True.
+
+        Returns:
+            NetworkInterface: the network interface to attach to the virtual machine
+        """
+        # the listing, the PUT and the GET of each helper block, run them in threads to overlap the round trips
+        with self.bulk(), ThreadPoolExecutor(max_workers=3) as executor:
+            nsg = executor.submit(
+                self.network_security_group, nsg_name, self.development_rules() if allow_development else None
+            )
+            vnet = executor.submit(self.virtual_network, vnet_name, address_prefixes=vnet_addresses)
+            public_ip = executor.submit(self.public_ip, public_ip_name)
+        nsg, vnet, public_ip = nsg.result(), vnet.result(), public_ip.result()
+
+        subnet = self.subnet(subnet_name, vnet=vnet, nsg=nsg, address_prefix=subnet_address)
+
+        return self.network_interface(nic_name, subnet=subnet, nsg=nsg, public_ip=public_ip)
+
+    def cluster_provision(
+        self,
+        vm_specs: List[dict],
+        nsg_name: str,
+        vnet_name: str,
+        vnet_addresses: List[str],
+        subnet_name: str,
+        subnet_address: str,
+        allow_development: bool = True,
+        max_workers: int = 8,
+    ) -> List[VirtualMachine]:
+        """Create several virtual machines which share one NSG, virtual network and subnet.
+        The shared network is created (or found) once per manager, the public IPs, network interfaces
+        and virtual machines are created concurrently.
+
+        Args:
+            vm_specs (List[dict]): keyword arguments of `virtual_machine` for each VM, "name" is required
+            nsg_name (str): network security group name
+            vnet_name (str): virtual network name
+            vnet_addresses (List[str]): virtual network address prefixes
+            subnet_name (str): subnetwork name
+            subnet_address (str): subnetwork address prefix
+            allow_development (bool, optional): open the development ports and ping on the NSG. Defaults to True.
+            max_workers (int, optional): number of parallel requests. Defaults to 8.
+
+        Returns:
+            List[VirtualMachine]: the virtual machines in the order of the specs
+        """
+        key = (nsg_name, vnet_name, subnet_name)
+        if key not in self._cluster_net:
+            with self.bulk(), ThreadPoolExecutor(max_workers=2) as executor:
+                nsg = executor.submit(
+                    self.network_security_group, nsg_name, self.development_rules() if allow_development else None
+                )
+                vnet = executor.submit(self.virtual_network, vnet_name, address_prefixes=vnet_addresses)
+            nsg, vnet = nsg.result(), vnet.result()
+            subnet = self.subnet(subnet_name, vnet=vnet, nsg=nsg, address_prefix=subnet_address)
+            self._cluster_net[key] = (nsg, subnet)
+        nsg, subnet = self._cluster_net[key]
+
+        names = [spec["name"] for spec in vm_specs]
+
+        with self.bulk(), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            public_ips = list(executor.map(self.public_ip, [f"{name}-{self.rsg}" for name in names]))
+
+        with self.bulk(), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            nics = list(
+                executor.map(
+                    lambda name, public_ip: self.network_interface(
+                        f"{name}-nic", subnet=subnet, nsg=nsg, public_ip=public_ip
+                    ),
+                    names,
+                    public_ips,
+                )
+            )
+
+        with self.bulk(), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(
+                executor.map(
+                    lambda spec, nic: self.virtual_machine(network_interface=nic, **spec),
+                    vm_specs,
+                    nics,
+                )
+            )
+
+    def deploy_vm_stack(
+        self,
+        name: str,
+        nsg_name: str,
+        vnet_name: str,
+        vnet_addresses: List[str],
+        subnet_name: str,
+        subnet_address: str,
+        public_ip_name: str,
+        nic_name: str,
+        image: dict,
+        size: str = "Standard_B2s",
+        user: str = None,
+        password: str = None,
+        spot_instance: bool = True,
+        max_price_per_hour: float = 2.0,
+        disk_size_gb: int = 32,
+        ssh_pubkey: str = None,
+        allow_development: bool = True,
+    ) -> VirtualMachine:
+        """Create a virtual machine with its network in a single ARM template deployment.
+        ARM resolves the dependencies between the resources and creates the independent ones in parallel.
+
+        Args:
+            name (str): Name of the virtual machine, also used as deployment name
+            nsg_name (str): network security group name
+            vnet_name (str): virtual network name
+            vnet_addresses (List[str]): virtual network address prefixes
+            subnet_name (str): subnetwork name
+            subnet_address (str): subnetwork address prefix
+            public_ip_name (str): public IP address name, also used as DNS name
+            nic_name (str): network interface name
+            image (dict): image description to use
+            size (str, optional): size of the VM. Defaults to "Standard_B2s".
+            user (str, optional): default username. Defaults to None.
+            password (str, optional): user's password. Defaults to None.
+            spot_instance (bool, optional): Whether to deploy a spot / pay as you go instance. Defaults to True.
+            max_price_per_hour (float, optional): Max price/hour in euros. Defaults to 2.0.
+            disk_size_gb (int, optional): Size of the OS disk. Defaults to 32.
+            ssh_pubkey (str, optional): SSH public key for logging in as user. Defaults to None.
+            allow_development (bool, optional): open the development ports and ping on the NSG. Defaults to True.
+
+        Returns:
+            VirtualMachine: The created virtual machine's descriptor.
+        """
+        security_rules = []
+        if allow_development:
+            security_rules = [
+                SecurityRule(name=name, **params).serialize() for name, params in self.development_rules().items()
+            ]
+
+        os_profile = {"computerName": name, "adminUsername": user, "adminPassword": password}
+        if ssh_pubkey:
+            public_key = {"path": f"/home/{user}/.ssh/authorized_keys", "keyData": ssh_pubkey}
+            os_profile["linuxConfiguration"] = {"ssh": {"publicKeys": [public_key]}}
+
+        priority = {}
+        if spot_instance:
+            priority = {
+                "priority": "Spot",
+                "evictionPolicy": "Deallocate",
+                "billingProfile": {"maxPrice": max_price_per_hour},
+            }
+
+        parameters = {
+            "location": self.get_location(),
+            "nsgName": nsg_name,
+            "securityRules": security_rules,
+            "vnetName": vnet_name,
+            "vnetAddresses": vnet_addresses,
+            "subnetName": subnet_name,
+            "subnetAddress": subnet_address,
+            "publicIpName": public_ip_name,
+            "dnsName": public_ip_name,
+            "nicName": nic_name,
+            "vmName": name,
+            "vmSize": size,
+            "imageReference": image,
+            "plan": self.config.get("nvidia_plan") or {},
+            "osProfile": os_profile,
+            "osDiskSizeGB": disk_size_gb,
+            "priority": priority,
+            "tags": {"persistent": "0", "development": "1"},
+        }
+
+        self.logger.info("Deploying virtual machine stack: %s", name)
+        deployment = self.client(ResourceManagementClient).deployments.create_or_update(
+            self.rsg,
+            name,
+            Deployment(
+                properties=DeploymentProperties(
+                    mode=DeploymentMode.incremental,
+                    template=VM_STACK_TEMPLATE,
+                    parameters={key: {"value": value} for key, value in parameters.items()},
+                )
+            ),
+        )
+        deployment.result()
+        # the deployment created or updated several resource kinds, list them again when needed
+        self._existing = {}
+        self._empty_rsg = False
+
+        self.logger.info("Deployed virtual machine stack: %s", name)
+        return self.client(ComputeManagementClient).virtual_machines.get(self.rsg, name)
+
+    def list_vms(self, verbose: bool = False) -> Iterable[VirtualMachine]:
         """List available VMs in the AzureManager resource group
 
+        The paged result is returned as is, so the pages are fetched only while the caller iterates it.
+
+        Args:
+            verbose (bool, optional): fetch all the VMs and log their names. Defaults to False.
+
         Returns:
-            List[VirtualMachine]: List of VM objects
+            Iterable[VirtualMachine]: VM objects (a list when verbose)
         """
         vms = self.client(ComputeManagementClient).virtual_machines.list(self.rsg)
-        for vm in vms:
-            print("\tVM: {}".format(vm.name))
+        if verbose:
+            vms = list(vms)
+            for vm in vms:
+                self.logger.info("VM: %s", vm.name)
         return vms
 
-    def delete_rsg(self, rsg=None) -> None:
-        """Delete the AzureManager resource group"""
+    def delete_rsg(self, rsg: str = None, wait: bool = False) -> LROPoller:
+        """Delete a resource group, the AzureManager resource group by default
+
+        Args:
+            rsg (str, optional): name of the resource group. Defaults to the AzureManager resource group.
+            wait (bool, optional): block until the deletion finishes. Defaults to False.
+
+        Returns:
+            LROPoller: poller of the deletion
+        """
         if not rsg:
             rsg = self.rsg
-        self.logger.info(f"Removing rsg: {rsg}...")
-        delete_async_operation = self.client(ResourceManagementClient).resource_groups.delete(rsg)
+        if rsg == self.rsg:
+            self._existing = {}
+            self._cluster_net = {}
+            self._file_services = {}
+        self.logger.info("Removing rsg: %s...", rsg)
+        # deleting a resource group takes minutes, poll it less often than the other operations
+        delete_async_operation = self.client(ResourceManagementClient).resource_groups.delete(
+            rsg, long_running_operation_timeout=30
+        )
 
-        if self._async_mode:
-            self.logger.warning(f"Deletion requested from Azure, this might take a while to finish.")
-        else:
+        if wait:
             self.logger.info("Deleting Azure resource group, it might take >5min...")
-            try:
-                self._async_wait(delete_async_operation)
-            except KeyboardInterrupt:
-                self.logger.warning(f"Deletion requested from Azure, this might take a while to finish.")
-                sys.exit(0)
+            delete_async_operation.result()
+        else:
+            self.logger.info("Deletion requested from Azure, this might take a while to finish.")
+        return delete_async_operation
+
+    def delete_rsgs(self, rsgs: List[str], wait: bool = False, max_workers: int = 8) -> List[LROPoller]:
+        """Delete several resource groups concurrently
+
+        Args:
+            rsgs (List[str]): names of the resource groups
+            wait (bool, optional): block until all of the deletions finish. Defaults to False.
+            max_workers (int, optional): number of parallel delete requests. Defaults to 8.
+
+        Returns:
+            List[LROPoller]: pollers of the deletions in the order of the resource groups
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pollers = list(executor.map(self.delete_rsg, rsgs))
+
+        if wait:
+            # the deletions run in parallel, waiting in sequence takes as long as the slowest one
+            for poller in pollers:
+                poller.result()
+        return pollers
 
     @staticmethod
     def generate_password(length=20, punctuation=True) -> str:
@@ -513,7 +1035,12 @@ class AzureManager(AzureApi):
             str: password
         """
         chars = string.ascii_letters + string.digits + ("+$_.;:,<>-[]{}" if punctuation else "")
-        return "".join(random.SystemRandom().choice(chars) for i in range(length))
+        # bytes above the largest multiple of len(chars) are dropped, so every character is equally likely
+        limit = 256 // len(chars) * len(chars)
+        password = []
+        while len(password) < length:
+            password.extend(chars[b % len(chars)] for b in secrets.token_bytes(2 * length) if b < limit)
+        return "".join(password[:length])
 
     def check_storage_available(self, name: str) -> bool:
         """Checks if storage account name is available
@@ -547,12 +1074,28 @@ class AzureManager(AzureApi):
 
         Args:
             rsg (str): virtual network resource group
-            vnet_name (str): [description]
+            vnet_name (str): virtual network name
 
         Returns:
             str: The virtual network ID
         """
-        return f"/subscriptions/{self.subscription_id}/resourceGroups/{rsg}/providers/Microsoft.Network/virtualNetworks/{vnet_name}"
+        key = (rsg, vnet_name)
+        if key not in self._vnet_ids:
+            self._vnet_ids[key] = f"{self.get_rsg_id(rsg)}/providers/Microsoft.Network/virtualNetworks/{vnet_name}"
+        return self._vnet_ids[key]
+
+    def get_rsg_id(self, rsg: str = None) -> str:
+        """Get resource group ID
+
+        Args:
+            rsg (str, optional): resource group name. Defaults to the AzureManager resource group.
+
+        Returns:
+            str: The resource group ID
+        """
+        if not rsg or rsg == self.rsg:
+            return self._rsg_id
+        return f"{self._sub_prefix}/resourceGroups/{rsg}"
 
     def get_location(self) -> str:
         """Get the location of the resource group
@@ -560,35 +1103,43 @@ class AzureManager(AzureApi):
         Returns:
             str: Azure location
         """
-        return self.client(ResourceManagementClient).resource_groups.get(self.rsg).location
+        if self._location is None:
+            self._location = self.client(ResourceManagementClient).resource_groups.get(self.rsg).location
+        return self._location
 
-    def create_storage_account(
+    def storage_account(
         self,
         account_name: str,
         subnets: List[str] = None,
         sku: str = "Premium_LRS",
         kind: str = "FileStorage",
         access_tier: str = "Hot",
-    ) -> str:
-        self.logger.info("Creating storage account")
+    ) -> StorageAccount:
+        """Create a storage account in the resource group
 
-        if subnets:
-            network_rules = NetworkRuleSet(
-                virtual_network_rules=[
-                    VirtualNetworkRule(action="Allow", virtual_network_resource_id=subnet) for subnet in set(subnets)
-                ],
-                default_action="Deny",
-                ip_rules=[],
-            )
+        Args:
+            account_name (str): name of the storage account
+            subnets (List[str], optional): subnet IDs allowed to access the account. Defaults to None (all networks).
+            sku (str, optional): storage SKU. Defaults to "Premium_LRS".
+            kind (str, optional): storage account kind. Defaults to "FileStorage".
+            access_tier (str, optional): access tier. Defaults to "Hot".
 
-        else:
-            network_rules = NetworkRuleSet(
-                virtual_network_rules=[],
-                default_action="Allow",
-                ip_rules=[],
-            )
+        Returns:
+            StorageAccount: the created storage account
+        """
+        self.logger.info("Creating storage account")
+
+        # deduplicate while keeping the order of the subnets
+        unique_subnets = list(dict.fromkeys(subnets or ()))
+        network_rules = NetworkRuleSet(
+            virtual_network_rules=[
+                VirtualNetworkRule(action="Allow", virtual_network_resource_id=subnet) for subnet in unique_subnets
+            ],
+            default_action="Deny" if unique_subnets else "Allow",
+            ip_rules=[],
+        )
 
-        storage_account = self.client(StorageManagementClient).storage_accounts.create(
+        storage_account = self.client(StorageManagementClient).storage_accounts.begin_create(
             self.rsg,
             account_name,
             parameters=StorageAccountCreateParameters(
@@ -601,18 +1152,47 @@ class AzureManager(AzureApi):
                 network_rule_set=network_rules,
             ),
         )
-        storage_account.result()
+        return storage_account.result()
 
-        access_key = (
-            self.client(StorageManagementClient).storage_accounts.list_keys(self.rsg, account_name).keys[0].value
-        )
+    def get_storage_key(self, account_name: str) -> str:
+        """Get the first access key of a storage account in the resource group
+
+        Args:
+            account_name (str): name of the storage account
 
-        return access_key
+        Returns:
+            str: storage account access key
+        """
+        return self.client(StorageManagementClient).storage_accounts.list_keys(self.rsg, account_name).keys[0].value
+
+    def create_storage_account(
+        self,
+        account_name: str,
+        subnets: List[str] = None,
+        sku: str = "Premium_LRS",
+        kind: str = "FileStorage",
+        access_tier: str = "Hot",
+    ) -> str:
+        """Create a storage account and return its access key, see `storage_account`
+
+        Returns:
+            str: storage account access key
+        """
+        self.storage_account(account_name, subnets=subnets, sku=sku, kind=kind, access_tier=access_tier)
+        return self.get_storage_key(account_name)
 
     def create_file_share(self, storage_account_name: str, share_name: str, size: int, key: str) -> FileService:
-        self.logger.info("Creating file share")
-        file_service = FileService(account_name=storage_account_name, account_key=key)
-        file_service.create_share(share_name, quota=size)
+        if storage_account_name not in self._file_services:
+            self._file_services[storage_account_name] = FileService(
+                account_name=storage_account_name, account_key=key, request_session=self._session
+            )
+        file_service = self._file_services[storage_account_name]
+
+        if file_service.exists(share_name):
+            self.logger.debug("Found file share: %s", share_name)
+        else:
+            self.logger.info("Creating file share")
+            file_service.create_share(share_name, quota=size)
 
         return file_service
 
@@ -629,64 +1209,78 @@ class AzureManager(AzureApi):
         """
         self.logger.info("Enabling vnet service endpoints")
 
-        subnetwork = self.client(NetworkManagementClient).subnets.get(rsg, vnet, subnet)
+        netclient = self.client(NetworkManagementClient)
+
+        subnetwork = netclient.subnets.get(rsg, vnet, subnet)
 
         needed_endpoints = ["Microsoft.Storage", "Microsoft.Sql", "Microsoft.KeyVault"]
 
-        if not subnetwork.service_endpoints:
-            enabled_endpoints = []
-            subnetwork.service_endpoints = []
-        else:
-            enabled_endpoints = [i.service for i in subnetwork.service_endpoints]
-        for endpoint in needed_endpoints:
-            if endpoint not in enabled_endpoints:
-                subnetwork.service_endpoints.append({"service": endpoint})
+        enabled_endpoints = {i.service for i in subnetwork.service_endpoints or []}
+        missing_endpoints = [endpoint for endpoint in needed_endpoints if endpoint not in enabled_endpoints]
+        policies_changed = (
+            disable_private_endpoint_policies and subnetwork.private_endpoint_network_policies != "Disabled"
+        )
 
-        if disable_private_endpoint_policies:
-            subnetwork.private_endpoint_network_policies = "Disabled"
+        if not missing_endpoints and not policies_changed:
+            self.logger.info("Vnet service endpoints already enabled")
+            return
 
-        async_subnet_update = self.client(NetworkManagementClient).subnets.create_or_update(
-            rsg,
-            vnet,
-            subnet,
-            subnetwork,
-        )
+        subnetwork.service_endpoints = (subnetwork.service_endpoints or []) + [
+            {"service": endpoint} for endpoint in missing_endpoints
+        ]
+        if policies_changed:
+            subnetwork.private_endpoint_network_policies = "Disabled"
 
-        subnet = async_subnet_update.result()
+        async_subnet_update = netclient.subnets.begin_create_or_update(rsg, vnet, subnet, subnetwork)
+        async_subnet_update.result()
 
         self.logger.info("Vnet service endpoints enabled")
 
-    def login_to_kubernetes_cluster(self, cluster_name: str) -> None:
-        """Login the kubectl CLI to AKS cluster described in the cluster configuration"""
+    def login_to_kubernetes_cluster(self, cluster_name: str, kubeconfig_path: Path = None) -> None:
+        """Login the kubectl CLI to AKS cluster described in the cluster configuration
+
+        The cluster user credentials are fetched through the container service API and merged into the
+        kubeconfig file, overwriting existing entries with the same name (like `az aks get-credentials`).
+
+        Args:
+            cluster_name (str): name of the AKS cluster in the resource group
+            kubeconfig_path (Path, optional): kubeconfig file to update. Defaults to ~/.kube/config.
+        """
         self.logger.info("Logging in kubernetes CLI client to cluster")
 
-        run_shell_command(
-            [
-                "az",
-                "aks",
-                "get-credentials",
-                "--resource-group",
-                self.rsg,
-                "--name",
-                cluster_name,
-                "--overwrite-existing",
-            ]
+        credentials = self.client(ContainerServiceClient).managed_clusters.list_cluster_user_credentials(
+            self.rsg, cluster_name
         )
+        cluster_config = yaml.safe_load(bytes(credentials.kubeconfigs[0].value).decode("utf-8"))
+
+        kubeconfig_path = kubeconfig_path or Path.home() / ".kube" / "config"
+        kubeconfig = {}
+        if kubeconfig_path.exists():
+            kubeconfig = yaml.safe_load(kubeconfig_path.read_text()) or {}
+
+        kubeconfig = _merge_kubeconfig(kubeconfig, cluster_config)
+
+        kubeconfig_path.parent.mkdir(parents=True, exist_ok=True)
+        # the file holds the cluster credentials, it must not be readable by others even while it is written
+        replace_file(kubeconfig_path, yaml.safe_dump(kubeconfig, default_flow_style=False), mode=0o600)
 
     def create_dns_zone(self, zone: str) -> None:
         """Create a public (global) DNS zone with given param ins cluster-config"""
-        _ = self.client(DnsManagementClient).zones.create_or_update(
-            self.rsg, zone, {"zone_type": "Public", "location": "global"}
-        )
+        dns = self.client(DnsManagementClient)
+        _ = dns.zones.create_or_update(self.rsg, zone, {"zone_type": "Public", "location": "global"})
 
-        ns_records = "\n".join(
-            [x.nsdname for x in self.client(DnsManagementClient).record_sets.get(self.rsg, zone, "@", "NS").ns_records]
-        )
+        ns_records = "\n".join(x.nsdname for x in dns.record_sets.get(self.rsg, zone, "@", "NS").ns_records)
         self.logger.warning(
-            f"\n{'*'*80}\nPlease add the following NS records to your DNS record: {zone}\n{ns_records}\n{'*'*80}\n"
+            "\n%s\nPlease add the following NS records to your DNS record: %s\n%s\n%s\n",
+            "*" * 80,
+            zone,
+            ns_records,
+            "*" * 80,
         )
 
-    def private_dns_link_to_vnet(self, dns_rsg: str, dns_name: str, vnet_rsg: str, vnet_name: str) -> None:
+    def private_dns_link_to_vnet(
+        self, dns_rsg: str, dns_name: str, vnet_rsg: str, vnet_name: str, wait: bool = True
+    ) -> LROPoller:
         """Link a private DNS zone to a virtual network
 
         Args:
@@ -694,8 +1288,12 @@ class AzureManager(AzureApi):
             dns_name (str): name of the private DNS zone
             vnet_rsg (str): resource group of the virtual network
             vnet_name (str): name of the virtual network
+            wait (bool, optional): wait for the link to be created. Defaults to True.
+
+        Returns:
+            LROPoller: poller of the link creation
         """
-        self.logger.info(f"Linking private DNS {dns_name} to {vnet_name}")
+        self.logger.info("Linking private DNS %s to %s", dns_name, vnet_name)
 
         params = VirtualNetworkLink(
             location="global",
@@ -709,28 +1307,34 @@ class AzureManager(AzureApi):
             vnet_name,
             parameters=params,
         )
-        _ = link.result()
-        self.logger.info(f"Private DNS is linked to VNET")
+        if wait:
+            _ = link.result()
+            self.logger.info("Private DNS is linked to VNET")
+        return link
 
     def create_private_dns_zone(self, zone: str, link_vnets: List[Tuple[str, str]] = [], rsg: str = None) -> None:
         """Create private DNS zone in Azure
 
+        The virtual network links are independent, they are started together and waited for at the end.
+
         Args:
             zone (str): domain name of the zone
+            link_vnets (List[Tuple[str, str]], optional): (rsg, name) of virtual networks to link. Defaults to [].
+            rsg (str, optional): resource group of the zone. Defaults to the manager resource group.
         """
-        self.logger.info(f"Creating private DNS zone: {zone}")
+        self.logger.info("Creating private DNS zone: %s", zone)
+        rsg = rsg or self.rsg
         dns = self.client(PrivateDnsManagementClient).private_zones.create_or_update(
-            self.rsg if not rsg else rsg, zone, PrivateZone(location="global")
+            rsg, zone, PrivateZone(location="global")
         )
         dns = dns.result()
 
-        for vnet_rsg, vnet_name in link_vnets:
-            self.private_dns_link_to_vnet(
-                rsg,
-                zone,
-                vnet_rsg,
-                vnet_name,
-            )
+        links = [
+            self.private_dns_link_to_vnet(rsg, zone, vnet_rsg, vnet_name, wait=False)
+            for vnet_rsg, vnet_name in link_vnets
+        ]
+        for link in links:
+            link.result()
 
         self.logger.info("Private DNS Zone created, VNETs linked")
 
@@ -741,13 +1345,13 @@ class AzureManager(AzureApi):
             name (str): name.<DNS zone>
             public_ips (List[str]): list of public IP addresses
         """
-        self.logger.info(f"Creating DNS record {name} for {public_ips}")
+        self.logger.info("Creating DNS record %s for %s", name, public_ips)
         self.client(DnsManagementClient).record_sets.create_or_update(
             self.rsg if not rsg else rsg,
             zone,
             name,
             "A",
-            {"ttl": 300, "arecords": [{"ipv4_address": ip} for ip in public_ips]},
+            DnsRecordSet(ttl=300, arecords=[DnsARecord(ipv4_address=ip) for ip in public_ips]),
         )
         self.logger.info("Record created")
 
@@ -757,7 +1361,7 @@ class AzureManager(AzureApi):
         Args:
             name (str): name of the record
         """
-        self.logger.info(f"Deleting DNS record for {name}")
+        self.logger.info("Deleting DNS record for %s", name)
         self.client(DnsManagementClient).record_sets.delete(
             self.rsg if not rsg else rsg,
             zone,
@@ -771,7 +1375,7 @@ class AzureManager(AzureApi):
         Args:
             name (str): name of the private DNS A record
         """
-        self.logger.info(f"Deleting Private DNS record for {name}")
+        self.logger.info("Deleting Private DNS record for %s", name)
         self.client(PrivateDnsManagementClient).record_sets.delete(
             self.rsg if not rsg else rsg,
             zone,
@@ -787,7 +1391,7 @@ class AzureManager(AzureApi):
             ip (str): IP address
             zone (str, optional): Zone of the A record. Defaults to None.
         """
-        self.logger.info(f"Creating Private DNS record {name}.{zone} for {ip}")
+        self.logger.info("Creating Private DNS record %s.%s for %s", name, zone, ip)
 
         if isinstance(ip, str):
             ips = [ARecord(ipv4_address=ip)]
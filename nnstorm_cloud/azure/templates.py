@@ -0,0 +1,119 @@
+"""
+Module templates containing ARM templates,
+which let Azure Resource Manager create several dependent resources in a single deployment.
+"""
+
+_NETWORK_API_VERSION = "2020-06-01"
+_COMPUTE_API_VERSION = "2020-06-01"
+
+# NSG, vnet with subnet, public IP, NIC and VM. Only the real dependencies are declared,
+# so ARM creates the NSG and the public IP in parallel with the rest of the stack.
+VM_STACK_TEMPLATE = {
+    "$schema": "https://schema.management.azure.com/schemas/2019-04-01/deploymentTemplate.json#",
+    "contentVersion": "1.0.0.0",
+    "parameters": {
+        "location": {"type": "string"},
+        "nsgName": {"type": "string"},
+        "securityRules": {"type": "array", "defaultValue": []},
+        "vnetName": {"type": "string"},
+        "vnetAddresses": {"type": "array"},
+        "subnetName": {"type": "string"},
+        "subnetAddress": {"type": "string"},
+        "publicIpName": {"type": "string"},
+        "dnsName": {"type": "string"},
+        "nicName": {"type": "string"},
+        "vmName": {"type": "string"},
+        "vmSize": {"type": "string"},
+        "imageReference": {"type": "object"},
+        "plan": {"type": "object", "defaultValue": {}},
+        "osProfile": {"type": "secureObject"},
+        "osDiskSizeGB": {"type": "int"},
+        "priority": {"type": "object", "defaultValue": {}},
+        "tags": {"type": "object", "defaultValue": {}},
+    },
+    "variables": {
+        "nsgId": "[resourceId('Microsoft.Network/networkSecurityGroups', parameters('nsgName'))]",
+        "vnetId": "[resourceId('Microsoft.Network/virtualNetworks', parameters('vnetName'))]",
+        "subnetId": "[resourceId('Microsoft.Network/virtualNetworks/subnets', "
+        "parameters('vnetName'), parameters('subnetName'))]",
+        "publicIpId": "[resourceId('Microsoft.Network/publicIPAddresses', parameters('publicIpName'))]",
+        "nicId": "[resourceId('Microsoft.Network/networkInterfaces', parameters('nicName'))]",
+    },
+    "resources": [
+        {
+            "type": "Microsoft.Network/networkSecurityGroups",
+            "apiVersion": _NETWORK_API_VERSION,
+            "name": "[parameters('nsgName')]",
+            "location": "[parameters('location')]",
+            "properties": {"securityRules": "[parameters('securityRules')]"},
+        },
+        {
+            "type": "Microsoft.Network/virtualNetworks",
+            "apiVersion": _NETWORK_API_VERSION,
+            "name": "[parameters('vnetName')]",
+            "location": "[parameters('location')]",
+            "dependsOn": ["[variables('nsgId')]"],
+            "properties": {
+                "addressSpace": {"addressPrefixes": "[parameters('vnetAddresses')]"},
+                "subnets": [
+                    {
+                        "name": "[parameters('subnetName')]",
+                        "properties": {
+                            "addressPrefix": "[parameters('subnetAddress')]",
+                            "networkSecurityGroup": {"id": "[variables('nsgId')]"},
+                        },
+                    }
+                ],
+            },
+        },
+        {
+            "type": "Microsoft.Network/publicIPAddresses",
+            "apiVersion": _NETWORK_API_VERSION,
+            "name": "[parameters('publicIpName')]",
+            "location": "[parameters('location')]",
+            "sku": {"name": "Standard"},
+            "properties": {
+                "publicIPAllocationMethod": "Static",
+                "dnsSettings": {"domainNameLabel": "[parameters('dnsName')]"},
+            },
+        },
+        {
+            "type": "Microsoft.Network/networkInterfaces",
+            "apiVersion": _NETWORK_API_VERSION,
+            "name": "[parameters('nicName')]",
+            "location": "[parameters('location')]",
+            "dependsOn": ["[variables('vnetId')]", "[variables('publicIpId')]"],
+            "properties": {
+                "networkSecurityGroup": {"id": "[variables('nsgId')]"},
+                "ipConfigurations": [
+                    {
+                        "name": "[parameters('nicName')]",
+                        "properties": {
+                            "primary": True,
+                            "subnet": {"id": "[variables('subnetId')]"},
+                            "publicIPAddress": {"id": "[variables('publicIpId')]"},
+                        },
+                    }
+                ],
+            },
+        },
+        {
+            "type": "Microsoft.Compute/virtualMachines",
+            "apiVersion": _COMPUTE_API_VERSION,
+            "name": "[parameters('vmName')]",
+            "location": "[parameters('location')]",
+            "dependsOn": ["[variables('nicId')]"],
+            "plan": "[if(empty(parameters('plan')), json('null'), parameters('plan'))]",
+            "tags": "[parameters('tags')]",
+            "properties": "[union(parameters('priority'), createObject("
+            "'hardwareProfile', createObject('vmSize', parameters('vmSize')), "
+            "'storageProfile', createObject("
+            "'imageReference', parameters('imageReference'), "
+            "'osDisk', createObject('createOption', 'FromImage', 'diskSizeGB', parameters('osDiskSizeGB'))), "
+            "'osProfile', parameters('osProfile'), "
+            "'networkProfile', createObject('networkInterfaces', createArray(createObject('id', variables('nicId'))))"
+            "))]",
+        },
+    ],
+    "outputs": {"fqdn": {"type": "string", "value": "[reference(variables('publicIpId')).dnsSettings.fqdn]"}},
+}
@@ -0,0 +1,26 @@
+import os
+from pathlib import Path
+
+import pytest
+from nnstorm_cloud.azure.api import AzureApi
+from nnstorm_cloud.azure.manager import AzureManager
+
+
+@pytest.fixture(scope="session")
+def auth():
+    auth_location = os.environ.get("AZURE_AUTH_LOCATION")
+    if not auth_location:
+        pytest.skip("AZURE_AUTH_LOCATION is not set")
+    return Path(auth_location)
+
+
+@pytest.fixture(scope="session")
+def api(auth):
+    with AzureApi(auth) as api:
+        yield api
+
+
+@pytest.fixture(scope="session")
+def mgr(auth):
+    with AzureManager("test-manager-0", auth_path=auth, location="westeurope", create_rsg=False) as mgr:
+        yield mgr
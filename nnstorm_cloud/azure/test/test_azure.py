@@ -1,47 +1,44 @@
-import os
-from pathlib import Path
-
-from nnstorm_cloud.azure.api import AzureApi
 from nnstorm_cloud.azure.keyvault import AzureKeyVault
 from nnstorm_cloud.azure.manager import AzureManager
 
-auth = Path(os.environ["AZURE_AUTH_LOCATION"])
-
 
-def test_api_init():
-    api = AzureApi(auth)
+def test_api_init(api):
+    assert api.subscription_id
 
 
-def test_object_id_fetch():
-    api = AzureApi(auth)
+def test_object_id_fetch(api):
     api.get_object_id()
 
 
-def test_kv_init():
+def test_kv_init(auth):
     kv = AzureKeyVault("test-kv-1", auth)
 
 
-def test_manager_init():
-    mgr = AzureManager("test-manager-0", auth_path=auth, location="westeurope", create_rsg=False)
+def test_kv_context_manager(auth):
+    with AzureKeyVault("test-kv-1", auth) as kv:
+        kv.check_name_available()
+
+
+def test_manager_init(mgr):
+    assert mgr.rsg == "test-manager-0"
 
 
-def test_storage_account_credentials():
-    mgr = AzureManager("test-manager-0", auth_path=auth, location="westeurope", create_rsg=False)
+def test_storage_account_credentials(mgr):
     mgr.check_storage_available("abc")
 
 
-def test_manager_rsg_create():
+def test_manager_rsg_create(auth):
     mgr = AzureManager("test-manager-1", auth_path=auth, location="westeurope")
     mgr.set_async(True)
     mgr.delete_rsg()
 
 
-def test_kv_available():
+def test_kv_available(auth):
     kv = AzureKeyVault("nnstorm-av-test-kv-1", auth)
     assert kv.check_name_available()
 
 
-def test_kv_full_lifecycle():
+def test_kv_full_lifecycle(auth):
     mgr = AzureManager("test-manager-2", auth_path=auth, location="westeurope")
 
     kv = AzureKeyVault("nnstorm-av-test-kv-3", auth)
@@ -51,6 +48,7 @@ def test_kv_full_lifecycle():
     kv.grant_access(rsg=mgr.rsg)
     kv.set_secret("test1", "x")
     assert kv.get_secret("test1") == "x"
+    assert kv.get_secrets(["test1", "test1"]) == ["x", "x"]
     kv.delete_secret("test1")
     kv.delete_keyvault(rsg=mgr.rsg, location=mgr.get_location())
     assert not kv.exists
@@ -0,0 +1,74 @@
+import logging
+import stat
+from types import SimpleNamespace
+
+import yaml
+from nnstorm_cloud.azure.manager import AzureManager, _merge_kubeconfig
+
+
+def _cluster_config(name, server="https://new"):
+    return {
+        "apiVersion": "v1",
+        "kind": "Config",
+        "clusters": [{"name": name, "cluster": {"server": server}}],
+        "users": [{"name": f"user-{name}", "user": {"token": "secret"}}],
+        "contexts": [{"name": name, "context": {"cluster": name, "user": f"user-{name}"}}],
+        "current-context": name,
+    }
+
+
+def _login(tmp_path, cluster_config):
+    credentials = SimpleNamespace(kubeconfigs=[SimpleNamespace(value=yaml.safe_dump(cluster_config).encode())])
+    managed_clusters = SimpleNamespace(list_cluster_user_credentials=lambda rsg, name: credentials)
+    mgr = AzureManager.__new__(AzureManager)
+    mgr.rsg = "rsg"
+    mgr.logger = logging.getLogger(__name__)
+    mgr.client = lambda client_class: SimpleNamespace(managed_clusters=managed_clusters)
+
+    kubeconfig_path = tmp_path / ".kube" / "config"
+    mgr.login_to_kubernetes_cluster("aks", kubeconfig_path)
+    return kubeconfig_path
+
+
+def test_merge_into_empty_kubeconfig():
+    merged = _merge_kubeconfig({}, _cluster_config("aks"))
+    assert merged == _cluster_config("aks")
+
+
+def test_merge_replaces_same_names_and_keeps_others():
+    kubeconfig = _cluster_config("other")
+    kubeconfig["preferences"] = {"colors": True}
+    stale = _cluster_config("aks", server="https://old")
+    for section in ("clusters", "users", "contexts"):
+        kubeconfig[section] += stale[section]
+
+    merged = _merge_kubeconfig(kubeconfig, _cluster_config("aks"))
+
+    assert [c["name"] for c in merged["clusters"]] == ["other", "aks"]
+    assert [u["name"] for u in merged["users"]] == ["user-other", "user-aks"]
+    assert [c["name"] for c in merged["contexts"]] == ["other", "aks"]
+    assert merged["clusters"][1]["cluster"]["server"] == "https://new"
+    assert merged["preferences"] == {"colors": True}
+    assert merged["current-context"] == "aks"
+
+
+def test_login_writes_new_private_kubeconfig(tmp_path):
+    kubeconfig_path = _login(tmp_path, _cluster_config("aks"))
+
+    assert yaml.safe_load(kubeconfig_path.read_text()) == _cluster_config("aks")
+    assert stat.S_IMODE(kubeconfig_path.stat().st_mode) == 0o600
+    assert not kubeconfig_path.with_name("config.tmp").exists()
+
+
+def test_login_merges_into_existing_kubeconfig(tmp_path):
+    kubeconfig_path = tmp_path / ".kube" / "config"
+    kubeconfig_path.parent.mkdir()
+    kubeconfig_path.write_text(yaml.safe_dump(_cluster_config("other")))
+    kubeconfig_path.chmod(0o644)
+
+    _login(tmp_path, _cluster_config("aks"))
+
+    kubeconfig = yaml.safe_load(kubeconfig_path.read_text())
+    assert [c["name"] for c in kubeconfig["clusters"]] == ["other", "aks"]
+    assert kubeconfig["current-context"] == "aks"
+    assert stat.S_IMODE(kubeconfig_path.stat().st_mode) == 0o600
@@ -0,0 +1,89 @@
+import logging
+import threading
+from types import SimpleNamespace
+
+import pytest
+from nnstorm_cloud.azure.api import AzureError
+from nnstorm_cloud.azure.manager import AzureManager
+
+
+def _manager(**clients):
+    mgr = AzureManager.__new__(AzureManager)
+    mgr.rsg = "rsg"
+    mgr.config = {}
+    mgr.logger = logging.getLogger(__name__)
+    mgr._async_mode = False
+    mgr._bulk_blocks = []
+    mgr._bulk_lock = threading.Lock()
+    mgr._bulk_local = threading.local()
+    mgr._existing = {}
+    mgr._existing_locks = {}
+    mgr._existing_locks_lock = threading.Lock()
+    mgr._empty_rsg = False
+    mgr.client = lambda client_class: SimpleNamespace(**clients)
+    return mgr
+
+
+def test_virtual_machine_lookup_without_location():
+    vm = SimpleNamespace(name="vm1")
+    mgr = _manager(virtual_machines=SimpleNamespace(list=lambda rsg: [vm]))
+    assert mgr.virtual_machine("vm1") is vm
+
+
+def test_virtual_machine_missing_without_network_interface():
+    mgr = _manager(virtual_machines=SimpleNamespace(list=lambda rsg: []))
+    with pytest.raises(AzureError):
+        mgr.virtual_machine("vm1")
+
+
+class _Poller:
+    def __init__(self, resource):
+        self.waited = False
+        self._polling_method = SimpleNamespace(
+            _initial_response=resource, _parse_resource=lambda response: dict(response, state="Creating")
+        )
+
+    def polling_method(self):
+        return self._polling_method
+
+    def result(self):
+        self.waited = True
+        return dict(self._polling_method._initial_response, state="Succeeded")
+
+
+def test_bulk_returns_initial_resource_and_waits_on_exit():
+    mgr = _manager()
+    poller = _Poller({"name": "ip"})
+    with mgr.bulk():
+        assert mgr._async_wait(poller) == {"name": "ip", "state": "Creating"}
+        assert not poller.waited
+    assert poller.waited
+
+
+def test_nested_bulk_keeps_outer_pending():
+    mgr = _manager()
+    outer, inner = _Poller({}), _Poller({})
+    with mgr.bulk():
+        mgr._async_wait(outer)
+        with mgr.bulk():
+            mgr._async_wait(inner)
+        assert inner.waited and not outer.waited
+    assert outer.waited
+    assert mgr._pending_handles() is None
+
+
+def test_bulk_collects_handles_of_worker_threads():
+    mgr = _manager()
+    poller = _Poller({})
+    with mgr.bulk():
+        worker = threading.Thread(target=mgr._async_wait, args=(poller,))
+        worker.start()
+        worker.join()
+        assert not poller.waited
+    assert poller.waited
+
+
+def test_no_bulk_waits():
+    mgr = _manager()
+    poller = _Poller({"name": "ip"})
+    assert mgr._async_wait(poller) == {"name": "ip", "state": "Succeeded"}
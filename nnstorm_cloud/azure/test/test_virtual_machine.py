@@ -0,0 +1,100 @@
+from pathlib import Path
+
+import pytest
+from nnstorm_cloud.azure.virtual_machine import AzureVM, _ssh_config_entry_pattern
+
+VM1 = "Host vm1\n     HostName vm1.example.com\n     Port 20022\n"
+VM10 = "Host vm10\n     HostName vm10.example.com\n"
+OTHER = "Host other\n     HostName other.example.com\n"
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    (tmp_path / ".ssh").mkdir()
+    monkeypatch.setattr(Path, "home", lambda: tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def vm():
+    vm = AzureVM.__new__(AzureVM)
+    vm.get_fqdn = lambda: "vm1.example.com"
+    return vm
+
+
+@pytest.mark.parametrize(
+    "config,expected",
+    [
+        (VM1 + "\n" + OTHER + "\n" + VM10, OTHER + "\n" + VM10),
+        (OTHER + "\n" + VM1 + "\n" + VM10, OTHER + "\n" + VM10),
+        (OTHER + "\n" + VM10 + "\n" + VM1, OTHER + "\n" + VM10 + "\n"),
+        (VM10 + OTHER, VM10 + OTHER),
+    ],
+    ids=["first", "middle", "last", "prefix"],
+)
+def test_entry_pattern_positions(config, expected):
+    assert _ssh_config_entry_pattern("vm1").sub("", config) == expected
+
+
+def test_entry_pattern_crlf_and_indented():
+    config = OTHER.replace("\n", "\r\n") + "  Host vm1\r\n     HostName vm1.example.com\r\n" + "\tHost vm10\r\n"
+    assert _ssh_config_entry_pattern("vm1").sub("", config) == OTHER.replace("\n", "\r\n") + "\tHost vm10\r\n"
+
+
+def test_remove_ssh_config_entry(home, vm):
+    config_path = home / ".ssh" / "config"
+    config_path.write_text(OTHER + "\n" + VM1 + "\n" + VM10)
+    vm.remove_ssh_config_entry("vm1")
+    assert config_path.read_text() == OTHER + "\n" + VM10
+
+
+def test_remove_ssh_config_entry_missing(home, vm):
+    vm.remove_ssh_config_entry("vm1")
+    assert not (home / ".ssh" / "config").exists()
+
+
+def test_add_ssh_config_entry_replaces_existing(home, vm):
+    config_path = home / ".ssh" / "config"
+    config_path.write_text(VM1 + "\n" + VM10)
+    vm.add_ssh_config_entry("vm1")
+    vm.add_ssh_config_entry("vm1")
+
+    config = config_path.read_text()
+    assert config.startswith(VM10 + "\nHost vm1\n")
+    assert config.count("Host vm1\n") == 1
+    assert "HostName vm1.example.com" in config
+
+
+def test_add_ssh_config_entry_new_file(home, vm):
+    vm.add_ssh_config_entry("vm1")
+    assert (home / ".ssh" / "config").read_text().startswith("Host vm1\n")
+
+
+def test_delete_from_known_hosts(home, vm):
+    known_hosts = home / ".ssh" / "known_hosts"
+    known_hosts.write_text(
+        "other.example.com ssh-ed25519 AAA\n[vm1.example.com]:20022 ssh-ed25519 BBB\nlast ssh-rsa CCC"
+    )
+    vm.delete_from_known_hosts()
+    assert known_hosts.read_text() == "other.example.com ssh-ed25519 AAA\nlast ssh-rsa CCC"
+
+
+def test_delete_from_known_hosts_not_listed(home, vm):
+    known_hosts = home / ".ssh" / "known_hosts"
+    known_hosts.write_text("other.example.com ssh-ed25519 AAA\n")
+    mtime = known_hosts.stat().st_mtime_ns
+    vm.delete_from_known_hosts()
+    assert known_hosts.read_text() == "other.example.com ssh-ed25519 AAA\n"
+    assert known_hosts.stat().st_mtime_ns == mtime
+
+
+def test_delete_from_known_hosts_empty(home, vm):
+    known_hosts = home / ".ssh" / "known_hosts"
+    known_hosts.write_text("")
+    vm.delete_from_known_hosts()
+    assert known_hosts.read_text() == ""
+
+
+def test_delete_from_known_hosts_missing(home, vm):
+    vm.delete_from_known_hosts()
+    assert not (home / ".ssh" / "known_hosts").exists()
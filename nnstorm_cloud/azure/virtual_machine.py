@@ -1,22 +1,85 @@
 """
 Azure virtual machine module, which has the AzureVM class.
 """
+import base64
 import logging
+import mmap
+import os
+import re
+import shlex
+import socket
 import subprocess
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Union
+from typing import Any, Dict, Iterable, List, Pattern, Tuple, Union
 
 from nnstorm_cloud.azure.api import AzureError
 from nnstorm_cloud.azure.manager import AzureManager
+from nnstorm_cloud.core.utils import replace_file
 
+from azure.core.polling import LROPoller
 from azure.mgmt.compute import ComputeManagementClient
 from azure.mgmt.compute.models import VirtualMachine
 
 
+# FQDNs of public IPs by (resource group, public IP name), with their expiry time
+_FQDN_CACHE: Dict[Tuple[str, str], Tuple[str, float]] = {}
+_FQDN_TTL = 900
+
+
+def _probe(command: List[str]) -> bool:
+    """Run a check command
+
+    Args:
+        command (List[str]): command line args of the check
+
+    Returns:
+        bool: whether the command succeeded
+    """
+    return subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
+
+def _port_open(host: str, port: int, timeout: float = 2.0) -> bool:
+    """Check whether a TCP port accepts connections
+
+    Args:
+        host (str): host name or IP address
+        port (int): TCP port
+        timeout (float, optional): connection timeout in seconds. Defaults to 2.0.
+
+    Returns:
+        bool: whether the connection succeeded
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _ssh_config_entry_pattern(entry_name: str) -> Pattern:
+    """Regex of a Host block in an ssh config file
+
+    Args:
+        entry_name (str): name of the Host entry
+
+    Returns:
+        Pattern: compiled regex matching the whole block
+    """
+    # the entry lasts until the next Host line, HostName options are not matched due to the word boundary,
+    # Host lines may be indented and end in CRLF when the file was edited on Windows
+    return re.compile(
+        rf"^[ \t]*Host[ \t]+{re.escape(entry_name)}[ \t]*\r?$.*?(?=^[ \t]*Host\b|\Z)", re.MULTILINE | re.DOTALL
+    )
+
+
 class AzureVM:
     """Azure Virtual Machine API wrapper with OO Design and type hinting"""
 
+    # seconds between polls of run commands, most of them finish in a few seconds
+    command_polling_interval = 2
+
     def __init__(self, api: AzureManager, azure_vm: Union[VirtualMachine, str], spot_instance=True):
         """Create an Azure VM object from a name or an Actual Azure VM instance
         If only a name is given, the VM will not get deployed until running the deploy function.
@@ -42,7 +105,7 @@ class AzureVM:
             self.name = azure_vm.name
             self.vm = azure_vm
 
-        self._fqdn = None
+        self._compute = None
 
         self.logger = logging.getLogger(f"AzureVM-{self.name}")
         self.logger.info("VM api available.")
@@ -98,32 +161,30 @@ class AzureVM:
             public_ip_name = self.default_ip_name
         if not nic_name:
             nic_name = f"{self.name}-nic"
-        if not user:
-            user = self.api.keyvault.get_secret(self.api.config["secrets"]["username"])
-        if not password:
-            password = self.api.keyvault.get_secret(self.api.config["secrets"]["password"])
         if not image:
             image = self.api.config["ubuntu_image"]
         if not size:
             size = "small"
 
-        # create network
-        nsg = self.api.network_security_group(nsg_name)
-        self.api.allow_nsg_development(nsg)
-        self.api.allow_nsg_ping(nsg)
-
-        vnet = self.api.virtual_network(vnet_name, address_prefixes=vnet_addresses)
-
-        subnet = self.api.subnet(
-            subnet_name,
-            vnet=vnet,
-            nsg=nsg,
-            address_prefix=subnet_address,
-        )
-
-        public_ip = self.api.public_ip(public_ip_name)
-
-        nic = self.api.network_interface(nic_name, subnet=subnet, nsg=nsg, public_ip=public_ip)
+        # the credentials are read from the keyvault while the network resources are being created
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            nic = executor.submit(
+                self.api.provision_vm_stack,
+                nsg_name,
+                vnet_name,
+                vnet_addresses,
+                subnet_name,
+                subnet_address,
+                public_ip_name,
+                nic_name,
+            )
+            if not user or not password:
+                secrets = self.api.config["secrets"]
+                user_secret, password_secret = executor.submit(
+                    self.api.keyvault.get_secrets, [secrets["username"], secrets["password"]]
+                ).result()
+                user, password = user or user_secret, password or password_secret
+            nic = nic.result()
 
         self.vm = self.api.virtual_machine(
             self.name,
@@ -137,6 +198,19 @@ class AzureVM:
             disk_size_gb=64,
             ssh_pubkey=ssh_pubkey,
         )
+        # the public IP might have been recreated with a new DNS name
+        self.invalidate_fqdn(public_ip_name)
+
+    @property
+    def compute(self) -> ComputeManagementClient:
+        """Compute client of the manager, kept by the VM so its operations skip the client lookup
+
+        Returns:
+            ComputeManagementClient: the cached compute client, sharing the manager's HTTP transport
+        """
+        if self._compute is None:
+            self._compute = self.api.client(ComputeManagementClient)
+        return self._compute
 
     def get_fqdn(self, public_ip_name: str = None) -> str:
         """Get Fully Qualified Domain Name (DNS name) of a public IP
@@ -147,37 +221,53 @@ class AzureVM:
         Returns:
             str: the FQDN of the public IP
         """
-        if not self._fqdn:
-            if not public_ip_name:
-                public_ip_name = self.default_ip_name
-            self._fqdn = self.api.public_ip(public_ip_name).dns_settings.fqdn
-        return self._fqdn
+        if not public_ip_name:
+            public_ip_name = self.default_ip_name
+
+        key = (self.api.rsg, public_ip_name)
+        cached = _FQDN_CACHE.get(key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
+        fqdn = self.api.public_ip(public_ip_name).dns_settings.fqdn
+        _FQDN_CACHE[key] = (fqdn, time.monotonic() + _FQDN_TTL)
+        return fqdn
+
+    def invalidate_fqdn(self, public_ip_name: str = None) -> None:
+        """Drop the cached FQDN of a public IP, so it is looked up again on the next access
+
+        Args:
+            public_ip_name (str, optional): name of the public IP. Defaults to None.
+        """
+        _FQDN_CACHE.pop((self.api.rsg, public_ip_name or self.default_ip_name), None)
 
-    def execute_command(self, command: str, user: str = "root") -> str:
+    def execute_command(self, command: Union[str, List[str]], user: str = "root") -> str:
         """Execute command on the VM
+        The command is sent base64 encoded and piped into the user's shell, so it can contain any quotes.
 
         Args:
-            command (str): string which will run on VM, do not use double quote!!!
+            command (Union[str, List[str]]): shell script or argument list which will run on VM
             user (str, optional): username. Defaults to "root".
 
         Returns:
             str: the string response with stdout and stderr
         """
-        if user:
-            command = f'runuser -l  {user} -c "{command}"'
+        if not isinstance(command, str):
+            command = " ".join(shlex.quote(arg) for arg in command)
+        encoded = base64.b64encode(command.encode()).decode()
+        shell = f"runuser -l {user} -s /bin/bash" if user else "/bin/bash"
         run_command_parameters = {
             "command_id": "RunShellScript",
-            "script": [command],
+            "script": [f"echo {encoded} | base64 -d | {shell}"],
             "parameters": [],
         }
 
-        poller = self.api.client(ComputeManagementClient).virtual_machines.run_command(
-            self.api.rsg, self.vm.name, run_command_parameters
+        poller = self.compute.virtual_machines.begin_run_command(
+            self.api.rsg, self.vm.name, run_command_parameters, polling_interval=self.command_polling_interval
         )
 
-        poller.wait()
         result = poller.result()  # Blocking till executed
-        self.api.logger.debug(f"Exec result:\n {result.value[0].message}")
+        self.api.logger.debug("Exec result:\n %s", result.value[0].message)
 
         return result.value[0].message
 
@@ -190,53 +280,99 @@ class AzureVM:
         """
         raise NotImplementedError  # TODO
 
+    def begin_restart(self) -> LROPoller:
+        """Start restarting the VM without waiting for it
+
+        Returns:
+            LROPoller: poller of the operation
+        """
+        return self.compute.virtual_machines.begin_restart(self.api.rsg, self.vm.name)
+
+    def begin_power_off(self) -> LROPoller:
+        """Start powering off the VM without waiting for it
+
+        Returns:
+            LROPoller: poller of the operation
+        """
+        return self.compute.virtual_machines.begin_power_off(self.api.rsg, self.vm.name)
+
+    def begin_start(self) -> LROPoller:
+        """Start the stopped VM without waiting for it
+
+        Returns:
+            LROPoller: poller of the operation
+        """
+        return self.compute.virtual_machines.begin_start(self.api.rsg, self.vm.name)
+
     def restart(self) -> None:
         """Restart the VM"""
-        async_vm_restart = self.api.client(ComputeManagementClient).virtual_machines.restart(self.api.rsg, self.vm.name)
-        self.api._async_wait(async_vm_restart)
+        self.api._async_wait(self.begin_restart())
 
     def power_off(self) -> None:
         """Power off the VM"""
-        async_vm_stop = self.api.client(ComputeManagementClient).virtual_machines.power_off(self.api.rsg, self.vm.name)
-        self.api._async_wait(async_vm_stop)
+        self.api._async_wait(self.begin_power_off())
 
     def start(self) -> None:
         """Start the stopped VM"""
-        async_vm_start = self.api.client(ComputeManagementClient).virtual_machines.start(self.api.rsg, self.vm.name)
-        self.api._async_wait(async_vm_start)
+        self.api._async_wait(self.begin_start())
+
+    @staticmethod
+    def wait_all(pollers: Iterable[LROPoller], max_workers: int = 12) -> List[Any]:
+        """Wait for the operations of several VMs, which were started with the begin_* methods.
+        ARM throttles concurrent write operations per subscription, so keep max_workers around a dozen.
+
+        Example:
+            AzureVM.wait_all([vm.begin_start() for vm in vms])
+
+        Args:
+            pollers (Iterable[LROPoller]): pollers of the running operations
+            max_workers (int, optional): maximum number of operations waited for in parallel. Defaults to 12.
 
-    def wait_for_service(self, ssh_port: int = 22) -> None:
-        """Wait for services to come up: ping should work and ssh listening on given port
+        Returns:
+            List[Any]: results of the operations in the order of the pollers
+        """
+        pollers = list(pollers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(poller.result) for poller in pollers]
+            # raise the first failure as soon as it happens
+            for future in as_completed(futures):
+                future.result()
+            return [future.result() for future in futures]
+
+    def wait_for_service(self, ssh_port: int = 22, timeout: float = 600) -> None:
+        """Wait for services to come up: ssh should accept connections and logins on given port
+        The port is checked with a plain TCP connection, ssh login is only attempted when the port is open.
+        The wait between the retries grows exponentially from 1s up to 30s.
 
         Args:
             ssh_port (int): The port on which SSH listens. Defaults to 22.
+            timeout (float, optional): maximum wait in seconds. Defaults to 600.
+
+        Raises:
+            TimeoutError: If the services are not available within the timeout
         """
-        ping, ssh = False, False
-        while (not ping) or (not ssh):
-            if not ping:
-                process = subprocess.Popen(
-                    ["ping", "-c", "1", self.get_fqdn()], shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                )
-                process.communicate()
-                if process.poll() == 0:
-                    ping = True
-
-            if not ssh:
-                process = subprocess.Popen(
-                    ["ssh", "-p", str(ssh_port), "-o", "StrictHostKeyChecking=no", "-t", self.get_fqdn(), "echo hi"],
-                    shell=False,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                )
-                process.communicate()
-                if process.poll() == 0:
-                    ssh = True
-            if not ping or not ssh:
-                time.sleep(1)
-                self.api.logger.debug(
-                    f"Waiting for service: Ping [{'OK' if ping else 'FAILED'}],"
-                    f" SSH on port {ssh_port} [{'OK' if ssh else 'FAILED'}]"
-                )
+        fqdn = self.get_fqdn()
+        ssh_command = ["ssh", "-p", str(ssh_port), "-o", "StrictHostKeyChecking=no", "-t", fqdn, "echo hi"]
+        port_open, ssh = False, False
+
+        delay, deadline = 1.0, time.monotonic() + timeout
+        while True:
+            port_open = port_open or _port_open(fqdn, ssh_port)
+            ssh = port_open and _probe(ssh_command)
+            if ssh:
+                return
+
+            self.api.logger.debug(
+                "Waiting for service: Port %d [%s], SSH on port %d [%s]",
+                ssh_port,
+                "OK" if port_open else "FAILED",
+                ssh_port,
+                "OK" if ssh else "FAILED",
+            )
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"Services of {self.name} are not available after {timeout}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
 
     def add_ssh_config_entry(self, entry_name: str = "cloud-gpu") -> None:
         """Add SSH config entry to $HOME/.ssh/config for easy access of the vm
@@ -244,17 +380,20 @@ class AzureVM:
         Args:
             entry_name (str, optional): Name of the entry in the config. Defaults to "cloud-gpu".
         """
-        self.remove_ssh_config_entry(entry_name)
+        config_path = Path.home() / ".ssh/config"
+        config = config_path.read_text() if config_path.is_file() else ""
 
+        fqdn = self.get_fqdn()
         entry = (
-            f"\nHost {entry_name}\n"
+            f"Host {entry_name}\n"
             f"     StrictHostKeyChecking no\n"
-            f"     HostName {self.get_fqdn()}\n"
+            f"     HostName {fqdn}\n"
             f"     ForwardX11 yes\n"
             f"     Port 20022\n"
         )
-        with open(Path.home() / ".ssh/config", "a") as f:
-            f.write(entry)
+        # separate the entry by a single empty line, so replacing it repeatedly does not grow the file
+        config = _ssh_config_entry_pattern(entry_name).sub("", config).rstrip("\r\n")
+        replace_file(config_path, f"{config}\n\n{entry}" if config else entry)
 
     def remove_ssh_config_entry(self, entry_name: str = "cloud-gpu") -> None:
         """Remove the ssh config entry for the vm in $HOME/.ssh/config
@@ -265,29 +404,31 @@ class AzureVM:
         config_path = Path.home() / ".ssh/config"
         if not config_path.is_file():
             return
-        with config_path.open("r") as f:
-            config = f.readlines()
-        found = False
-        done = False
-        clean_config = []
-        for line in config:
-            if f"Host {entry_name}" in line:
-                found = True
-            elif found:
-                if "Host " in line:
-                    done = True
-            if not (found and not done):
-                clean_config.append(line)
-        with open(Path.home() / ".ssh/config", "w") as f:
-            f.writelines(clean_config)
+        config = config_path.read_text()
+        clean_config = _ssh_config_entry_pattern(entry_name).sub("", config)
+        if clean_config != config:
+            replace_file(config_path, clean_config)
 
     def delete_from_known_hosts(self) -> None:
         """Delete the VM's entry from the known hosts file to eliminate warnings and spamming."""
-        with open(Path.home() / ".ssh/known_hosts", "r") as f:
-            hosts = f.readlines()
-            hosts = [h for h in hosts if self.get_fqdn() not in h]
-        with open(Path.home() / ".ssh/known_hosts", "w") as f:
-            f.writelines(hosts)
+        known_hosts_path = Path.home() / ".ssh/known_hosts"
+        fqdn = self.get_fqdn()
+        # search the file in place first, it is only rewritten when the VM is in it
+        try:
+            with known_hosts_path.open("rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if mm.find(fqdn.encode()) == -1:
+                        return
+        except FileNotFoundError:
+            return
+
+        pattern = re.compile(rf"^.*{re.escape(fqdn)}.*(\n|\Z)", re.MULTILINE)
+        hosts = known_hosts_path.read_text()
+        clean_hosts = pattern.sub("", hosts)
+        if clean_hosts != hosts:
+            replace_file(known_hosts_path, clean_hosts)
 
     def check_vm_exists(self) -> None:
         """Asserts that the VM exists and raises an RuntimeError if not
@@ -0,0 +1,43 @@
+import stat
+
+from nnstorm_cloud.core.utils import replace_file
+
+
+def _mode(path):
+    return stat.S_IMODE(path.stat().st_mode)
+
+
+def test_replace_file_new(tmp_path):
+    path = tmp_path / "config"
+    replace_file(path, "new")
+    assert path.read_text() == "new"
+    assert not (tmp_path / "config.tmp").exists()
+
+
+def test_replace_file_keeps_mode(tmp_path):
+    path = tmp_path / "config"
+    path.write_text("old")
+    path.chmod(0o640)
+    replace_file(path, "new")
+    assert path.read_text() == "new"
+    assert _mode(path) == 0o640
+
+
+def test_replace_file_with_mode(tmp_path):
+    path = tmp_path / "config"
+    path.write_text("old")
+    path.chmod(0o644)
+    replace_file(path, "secret", mode=0o600)
+    assert path.read_text() == "secret"
+    assert _mode(path) == 0o600
+
+
+def test_replace_file_leftover_tmp(tmp_path):
+    path = tmp_path / "config"
+    tmp = tmp_path / "config.tmp"
+    tmp.write_text("stale")
+    tmp.chmod(0o666)
+    replace_file(path, "secret", mode=0o600)
+    assert path.read_text() == "secret"
+    assert _mode(path) == 0o600
+    assert not tmp.exists()
@@ -1,8 +1,12 @@
 """NNstorm utils for Azure deployment"""
+import io
 import logging
 import os
+import selectors
+import stat
 import subprocess
-from typing import List, Optional, Tuple, Union
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 
 def run_shell_command(
@@ -11,6 +15,7 @@ def run_shell_command(
     shell: bool = False,
     log: Optional[logging.Logger] = None,
     poll: bool = True,
+    input: Optional[str] = None,
 ) -> Tuple[str, str]:
     """Runs shell command in host shell and returns output and error response
 
@@ -20,6 +25,8 @@ def run_shell_command(
         shell (bool, optional): run in shell mode (if arg_list is list). Defaults to False.
         log (Optional[logging.Logger], optional): Logger object to use. Defaults to None.
         poll (bool): whether to poll the process or return its stdout as a whole
+        input (Optional[str], optional): text to write to the standard input, the output is not polled then.
+            Defaults to None.
 
     Raises:
         RuntimeError: If process did not return with 0
@@ -30,50 +37,82 @@ def run_shell_command(
     if not log:
         log = logging.getLogger("shell")
 
-    cmd = command_arg_list if isinstance(command_arg_list, str) else " ".join(command_arg_list)
-    log.debug(f"Running shell script: {cmd}")
+    if log.isEnabledFor(logging.DEBUG):
+        cmd = command_arg_list if isinstance(command_arg_list, str) else " ".join(command_arg_list)
+        log.debug("Running shell script: %s", cmd)
+
+    if poll and input is None:
+        process = subprocess.Popen(command_arg_list, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = _stream_process_output(process, log.info if show_info else log.debug, log.debug)
+        returncode = process.returncode
+    else:
+        result = subprocess.run(
+            command_arg_list,
+            shell=shell,
+            input=input,
+            capture_output=True,
+            encoding="utf-8",
+            errors="replace",
+            check=False,
+        )
+        stdout, stderr, returncode = result.stdout, result.stderr, result.returncode
+
+    if returncode != 0:
+        log.warning(stdout)
+        log.error(stderr)
+        raise RuntimeError("Shellscript exited with non-0 exit code!")
 
-    process = subprocess.Popen(command_arg_list, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return stdout, stderr
 
-    if poll:
-        outs = []
-        while True:
-            output = process.stdout.readline()
 
-            log_fn = log.info if show_info else log.debug
+def _stream_process_output(
+    process: subprocess.Popen, log_out: Callable[[str], None], log_err: Callable[[str], None]
+) -> Tuple[str, str]:
+    """Read stdout and stderr of a process as the output arrives and log it line by line.
+    Both pipes are watched with a selector, so a command which writes to one of them does not block the other.
 
-            if len(output) > 0:
-                try:
-                    s = output.decode("utf-8").strip()
-                    outs.append(s)
-                    log_fn(outs[-1])
-                except UnicodeDecodeError:
-                    log.warning(f"Could not decode {output} with utf-8")
+    Args:
+        process (subprocess.Popen): process with piped stdout and stderr
+        log_out (Callable[[str], None]): logging function of the stdout lines
+        log_err (Callable[[str], None]): logging function of the stderr lines
 
-            if process.poll() is not None:
-                break
+    Returns:
+        Tuple[str, str]: standard output and standard error as str
+    """
+    buffers: Dict[int, io.StringIO] = {}
+    line_counts: Dict[int, int] = {}
+    partial: Dict[int, bytes] = {}
+    with selectors.DefaultSelector() as sel:
+        for pipe, log_fn in ((process.stdout, log_out), (process.stderr, log_err)):
+            fd = pipe.fileno()
+            os.set_blocking(fd, False)
+            sel.register(fd, selectors.EVENT_READ, log_fn)
+            buffers[fd], line_counts[fd], partial[fd] = io.StringIO(), 0, b""
+
+        while sel.get_map():
+            for key, _ in sel.select(timeout=0.1):
+                fd, log_fn = key.fd, key.data
+                data = os.read(fd, 65536)
+                if not data:
+                    # end of file, flush the unterminated last line
+                    sel.unregister(fd)
+                    data, partial[fd] = partial[fd], b""
+                    chunks = [data] if data else []
+                else:
+                    chunks = (partial[fd] + data).split(b"\n")
+                    partial[fd] = chunks.pop()
+                buffer = buffers[fd]
+                for chunk in chunks:
+                    line = chunk.decode("utf-8", errors="replace").strip()
+                    # lines are separated by newlines, the output does not end with one
+                    if line_counts[fd]:
+                        buffer.write("\n")
+                    buffer.write(line)
+                    line_counts[fd] += 1
+                    log_fn(line)
 
     process.wait()
-    stdout, stderr = process.communicate()
-
-    try:
-        stdout = stdout.decode("utf-8")
-    except UnicodeDecodeError:
-        pass
-    try:
-        stderr = stderr.decode("utf-8")
-    except UnicodeDecodeError:
-        pass
-
-    if poll:
-        stdout = "\n".join(outs)
-
-    if process.returncode != 0:
-        log.warning(stdout)
-        log.error(stderr)
-        raise RuntimeError("Shellscript exited with non-0 exit code!")
-
-    return stdout, stderr
+    return buffers[process.stdout.fileno()].getvalue(), buffers[process.stderr.fileno()].getvalue()
 
 
 def get_environment_variable(name: str) -> str:
@@ -95,3 +134,29 @@ def get_environment_variable(name: str) -> str:
     if len(env_var) == 0:
         raise RuntimeError(f"'{name}' env var is empty.")
     return env_var
+
+
+def replace_file(path: Path, content: str, mode: Optional[int] = None) -> None:
+    """Replace the content of a file atomically, so an interrupted write cannot leave it truncated.
+    The new content is written to a temporary file next to it, which is renamed over the original.
+
+    Args:
+        path (Path): file to write
+        content (str): new content of the file
+        mode (Optional[int], optional): permissions of the file, set before any content is written, so a private
+            file is never readable by others. Defaults to None, keeping the permissions of the original file.
+    """
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    if mode is None and path.is_file():
+        mode = stat.S_IMODE(path.stat().st_mode)
+    try:
+        # a leftover temporary file would keep its own permissions
+        tmp_path.unlink()
+    except FileNotFoundError:
+        pass
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666 if mode is None else mode & 0o600)
+    with os.fdopen(fd, "w") as tmp_file:
+        if mode is not None:
+            os.fchmod(tmp_file.fileno(), mode)
+        tmp_file.write(content)
+    os.replace(tmp_path, path)
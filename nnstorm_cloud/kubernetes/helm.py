@@ -1,17 +1,78 @@
 """Helm Python wrapper"""
 
+import json
 import logging
+import threading
+import time
+from concurrent.futures import Future, wait
 from pathlib import Path
-from typing import List, Union
+from typing import Dict, List, Optional, Union
 
 from nnstorm_cloud.core.utils import run_shell_command
+from nnstorm_cloud.kubernetes.kubectl import invalidate_list_cache
 
-repos = []
+# seconds while the listed releases of a namespace are used to answer exists()
+_RELEASE_CACHE_TTL = 30
+
+# longest single --set argument, longer value lists are split to stay well below the argv limit of the OS
+_MAX_SET_ARG_LENGTH = 128 * 1024
+
+
+def _set_value(value: Union[str, list, tuple]) -> str:
+    """Render a chart value in helm's --set syntax
+
+    Args:
+        value (Union[str, list, tuple]): the value, lists and tuples are rendered as a helm list
+
+    Returns:
+        str: the value with the commas escaped that would start a new key-value pair
+    """
+    if isinstance(value, (list, tuple)):
+        return "{" + ",".join(str(v).replace(",", "\\,") for v in value) + "}"
+    value = str(value)
+    # a value already written as a helm list keeps its commas as item separators
+    if value.startswith("{") and value.endswith("}"):
+        return value
+    return value.replace(",", "\\,")
+
+
+def _set_args(config_map: dict) -> List[str]:
+    """Build the --set arguments of the chart values, all pairs are joined by commas into as few arguments as possible
+
+    Args:
+        config_map (dict): dictionary of key-value pairs for the chart values
+
+    Returns:
+        List[str]: helm command line arguments
+    """
+    values = [f"{key}={_set_value(value)}" for key, value in config_map.items()]
+
+    groups, group, length = [], [], 0
+    for v in values:
+        if group and length + len(v) + 1 > _MAX_SET_ARG_LENGTH:
+            groups.append(group)
+            group, length = [], 0
+        group.append(v)
+        length += len(v) + 1
+    if group:
+        groups.append(group)
+
+    args = []
+    for g in groups:
+        args.extend(["--set", ",".join(g)])
+    return args
 
 
 class HelmAPI:
     """Python HELM API"""
 
+    # repos added in this process with the result of their helm repo add, shared by every instance
+    # as helm's repo list is global, the futures of adds in progress are not done yet
+    _repos: Dict[str, Future] = {}
+    _repos_lock = threading.Lock()
+    # whether repos were added since the last helm repo update
+    _repos_dirty = False
+
     def __init__(self, namespace: str):
         """Create the Helm API object with a given namespace
 
@@ -19,9 +80,27 @@ class HelmAPI:
             namespace (str): Kubernetes namespace
         """
         self.namespace = namespace
-        self.repos = []
         self.namespace_args = ["--namespace", self.namespace]
 
+        self._release_cache: Optional[Dict[str, dict]] = None
+        self._release_cache_expiry = 0.0
+
+    def _releases(self) -> Dict[str, dict]:
+        """Releases of the namespace by name, listed with a single helm call and cached for a short time.
+        The cache is dropped whenever this object installs or uninstalls a chart.
+
+        Returns:
+            Dict[str, dict]: release info by release name
+        """
+        if self._release_cache is None or time.monotonic() > self._release_cache_expiry:
+            # helm lists only 256 releases by default, --max 0 lists all of them
+            stdout, _ = run_shell_command(
+                ["helm", "list", "--all", "--max", "0", "-o", "json"] + self.namespace_args, poll=False
+            )
+            self._release_cache = {r["name"]: r for r in json.loads(stdout or "[]")}
+            self._release_cache_expiry = time.monotonic() + _RELEASE_CACHE_TTL
+        return self._release_cache
+
     def install(
         self,
         name: str,
@@ -46,11 +125,9 @@ class HelmAPI:
         if reinstall:
             self.uninstall(name, tolerate_error=True)
 
-        values = [f"{key}={value}" for key, value in config_map.items()]
-        args = []
-        for v in values:
-            args.append("--set")
-            args.append(v)
+        self.flush_repos()
+
+        args = _set_args(config_map)
 
         if atomic:
             args.append("--atomic")
@@ -63,23 +140,35 @@ class HelmAPI:
 
         cmd = ["helm", helm_cmd, name, str(chart)] + self.namespace_args + args + extra_args
 
-        run_shell_command(cmd)
+        try:
+            run_shell_command(cmd)
+        finally:
+            self._release_cache = None
+            # charts can create resources in any namespace
+            invalidate_list_cache()
 
     def uninstall(self, name: str, tolerate_error=False) -> None:
         """Uninstall HELM chart from cluster
 
         Args:
             name (str): name of the chart
-            tolerate_error (bool, optional): if true, errors are tolerated. Defaults to False.
+            tolerate_error (bool, optional): if true, a chart which is not installed is skipped. Defaults to False.
 
         Raises:
-            RuntimeError: If error is not tolerated and something goes wrong
+            RuntimeError: If the chart is not installed and the error is not tolerated, or helm fails
         """
+        # the release may have been installed by another process since it was listed, look it up again
+        self._release_cache = None
+        if not self.exists(name):
+            if tolerate_error:
+                return
+            raise RuntimeError(f"HELM chart {name} is not installed in namespace {self.namespace}")
+
         try:
             run_shell_command(["helm", "uninstall", name] + self.namespace_args)
-        except RuntimeError as e:
-            if not tolerate_error:
-                raise e
+        finally:
+            self._release_cache = None
+            invalidate_list_cache()
 
     def exists(self, name: str) -> bool:
         """Check if HELM chart exists in namespace on cluster
@@ -90,11 +179,7 @@ class HelmAPI:
         Returns:
             bool: whether chart is installed
         """
-        try:
-            run_shell_command(["helm", "status", name] + self.namespace_args)
-            return True
-        except RuntimeError:
-            return False
+        return name in self._releases()
 
     def add_repo(self, branch: str, name: str) -> None:
         """Add and update repo from public repos
@@ -103,23 +188,72 @@ class HelmAPI:
             branch (str): branch name for the repo
             name (str): repo name
         """
-        if name not in repos:
+        self.add_repo_deferred(branch, name)
+        self.flush_repos()
+
+    def add_repo_deferred(self, branch: str, name: str) -> None:
+        """Add a repo from public repos without updating it.
+        The update runs once for every added repo with flush_repos, which install calls as well.
+
+        Args:
+            branch (str): branch name for the repo
+            name (str): repo name
+
+        Raises:
+            RuntimeError: If the repo cannot be added, also when another thread was adding it
+        """
+        with HelmAPI._repos_lock:
+            added = HelmAPI._repos.get(name)
+            if added is None:
+                added = HelmAPI._repos[name] = Future()
+                adding = True
+            else:
+                adding = False
+
+        if not adding:
+            # another thread adds the repo, it is usable once that add finished
+            added.result()
+            return
+
+        try:
             run_shell_command(["helm", "repo", "add", branch, name])
-            repos.append(name)
+        except RuntimeError as error:
+            with HelmAPI._repos_lock:
+                del HelmAPI._repos[name]
+            added.set_exception(error)
+            raise
+        with HelmAPI._repos_lock:
+            HelmAPI._repos_dirty = True
+        added.set_result(None)
+
+    def flush_repos(self) -> None:
+        """Update the repos if any was added since the last update
+
+        Raises:
+            RuntimeError: If the repos cannot be updated
+        """
+        with HelmAPI._repos_lock:
+            in_progress = [added for added in HelmAPI._repos.values() if not added.done()]
+        # repos being added by other threads are not dirty yet, but they must be part of the update
+        wait(in_progress)
+
+        with HelmAPI._repos_lock:
+            if not HelmAPI._repos_dirty:
+                return
 
             retries = 10
-            i = 0
-            while True:
+            for attempt in range(1, retries + 1):
                 try:
                     run_shell_command(["helm", "repo", "update"])
-                except:
-                    logging.error("Could not update HELM repo!")
-                    i += 1
+                except RuntimeError:
+                    if attempt == retries:
+                        logging.error("Could not update HELM repos after %d attempts!", retries)
+                        raise RuntimeError("Cannot update HELM repo!!")
+                    logging.warning("Could not update HELM repos, retrying (%d/%d)", attempt, retries)
                 else:
                     break
 
-                if i == retries:
-                    raise RuntimeError("Cannot update HELM repo!!")
+            HelmAPI._repos_dirty = False
 
     def deploy_ingress_controller(self, name: str, replicas: int = 2, controller_definition: Path = None) -> None:
         """Deploy a Kubernetes ingress controller
@@ -129,7 +263,7 @@ class HelmAPI:
             replicas (int, optional): replica count of containers. Defaults to 2.
             controller_definition (Path, optional): controller definition. Defaults to None.
         """
-        self.add_repo("ingress-nginx", "https://kubernetes.github.io/ingress-nginx")
+        self.add_repo_deferred("ingress-nginx", "https://kubernetes.github.io/ingress-nginx")
 
         values = {
             "controller.replicaCount": replicas,
@@ -1,12 +1,191 @@
 """ Kubectl Kubernetes CLI Python wrapper """
+import atexit
+import base64
+import copy
 import json
 import logging
+import re
+import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import requests
 from nnstorm_cloud.core.utils import run_shell_command
 
+# kubectl commands which do not change the cluster
+_READ_COMMANDS = frozenset({"get", "logs", "describe", "top", "version"})
+# jsonpath of the public IP addresses of a load balancer service
+_INGRESS_IPS_TEMPLATE = "{.status.loadBalancer.ingress[*].ip}"
+# field manager of the server-side applied objects
+_FIELD_MANAGER = "nnstorm"
+# kubectl commands which do not take the --wait flag
+_NO_WAIT_COMMANDS = frozenset({"create", "get", "rollout", "label", "scale", "logs"})
+
+# listed resources by (namespace, resource type) with their expiry time, shared by every KubeControl object
+_LIST_CACHE: Dict[Tuple[str, str], Tuple[List, float]] = {}
+_LIST_CACHE_TTL = 5
+_LIST_CACHE_LOCK = threading.Lock()
+# incremented by every invalidation, lists started before one are not stored
+_LIST_CACHE_GENERATION = 0
+
+# az aks get-versions output is cached here, versions change at most daily
+_AKS_VERSIONS_CACHE_DIR = Path.home() / ".cache" / "nnstorm"
+_AKS_VERSIONS_CACHE_TTL = 3600
+# the versions read in this process by location, with the expiry time of the cache file they came from
+_AKS_VERSIONS: Dict[str, Tuple[List[dict], float]] = {}
+
+# REST paths of the resource lists which can be read through kubectl proxy
+_LIST_PATHS = {
+    "secrets": "/api/v1/namespaces/{namespace}/secrets",
+    "svc": "/api/v1/namespaces/{namespace}/services",
+    "deployments.apps": "/apis/apps/v1/namespaces/{namespace}/deployments",
+    "jobs.batch": "/apis/batch/v1/namespaces/{namespace}/jobs",
+}
+
+
+class _KubeProxy:
+    """kubectl proxy process with a keep-alive HTTP session, shared by every KubeControl object of the process.
+    The users are counted, the proxy is stopped when the last one releases it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._process = None
+        self._url = None
+        self._session = None
+        self._users = 0
+
+    def acquire(self) -> None:
+        """Register a user of the proxy, it is started only on the first request"""
+        with self._lock:
+            self._users += 1
+
+    def release(self) -> None:
+        """Unregister a user of the proxy and stop the proxy if it was the last one"""
+        with self._lock:
+            self._users -= 1
+            if self._users == 0:
+                self._stop()
+
+    def _start(self) -> None:
+        """Start kubectl proxy on a free loopback port
+
+        Raises:
+            RuntimeError: If the proxy cannot be started
+        """
+        # port 0 lets the proxy pick a free port, which it prints when it is ready
+        self._process = subprocess.Popen(
+            ["kubectl", "proxy", "--address", "127.0.0.1", "--port", "0"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        match = re.search(r"127\.0\.0\.1:(\d+)", self._process.stdout.readline())
+        if not match:
+            self._stop()
+            raise RuntimeError("Could not start kubectl proxy")
+        self._url = f"http://127.0.0.1:{match.group(1)}"
+        self._session = requests.Session()
+
+    def get(self, path: str, params: dict = None) -> dict:
+        """Send a GET request to the API server through the proxy, the proxy is started on first use.
+        The proxy keeps the authenticated connection to the cluster, requests reuse a local keep-alive session.
+
+        Args:
+            path (str): REST path of the resource
+            params (dict, optional): query parameters. Defaults to None.
+
+        Raises:
+            RuntimeError: If the proxy cannot be started
+
+        Returns:
+            dict: the JSON response
+        """
+        with self._lock:
+            if not self._process:
+                self._start()
+            session, url = self._session, self._url
+
+        response = session.get(url + path, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def stop(self) -> None:
+        """Stop the proxy if it is running"""
+        with self._lock:
+            self._stop()
+
+    def _stop(self) -> None:
+        """Stop the proxy if it is running, the lock must be held"""
+        if self._session:
+            self._session.close()
+            self._session = None
+        if self._process:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+
+_PROXY = _KubeProxy()
+atexit.register(_PROXY.stop)
+
+
+def invalidate_list_cache(namespace: Optional[str] = None) -> None:
+    """Drop the cached resource lists of a namespace, or of every namespace.
+    Commands run through KubeControl do it themselves, other tools changing the cluster (like helm) must call it.
+
+    Args:
+        namespace (Optional[str], optional): namespace name, None for all of them. Defaults to None.
+    """
+    global _LIST_CACHE_GENERATION
+    with _LIST_CACHE_LOCK:
+        _LIST_CACHE_GENERATION += 1
+        if namespace is None:
+            _LIST_CACHE.clear()
+        else:
+            for key in [k for k in _LIST_CACHE if k[0] == namespace]:
+                del _LIST_CACHE[key]
+
+
+def _get_aks_versions(location: str) -> List[dict]:
+    """Get the AKS orchestrator versions of a location.
+    The az CLI output is kept in the user's cache directory for an hour, so other processes can use it as well.
+    The process keeps the versions in memory until the cache file expires.
+
+    Args:
+        location (str): name of the Azure location
+
+    Returns:
+        List[dict]: orchestrator version descriptors
+    """
+    cached = _AKS_VERSIONS.get(location)
+    if cached and cached[1] > time.time():
+        return cached[0]
+
+    cache_path = _AKS_VERSIONS_CACHE_DIR / f"aks-versions-{location}.json"
+    try:
+        expiry = cache_path.stat().st_mtime + _AKS_VERSIONS_CACHE_TTL
+        if expiry > time.time():
+            versions = json.loads(cache_path.read_text())["orchestrators"]
+            _AKS_VERSIONS[location] = (versions, expiry)
+            return versions
+    except (OSError, ValueError, KeyError):
+        # missing or broken cache file, ask Azure
+        pass
+
+    out, _ = run_shell_command(["az", "aks", "get-versions", "-l", location, "-o", "json"])
+    versions = json.loads(out)["orchestrators"]
+    _AKS_VERSIONS[location] = (versions, time.time() + _AKS_VERSIONS_CACHE_TTL)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(out)
+    except OSError as e:
+        logging.debug("Could not cache AKS versions: %s", e)
+    return versions
+
 
 def get_latest_version_on_azure(location: str) -> str:
     """Get latest available AKS cluster version
@@ -17,40 +196,135 @@ def get_latest_version_on_azure(location: str) -> str:
     Returns:
         str: latest version
     """
-    out, _ = run_shell_command(["az", "aks", "get-versions", "-l", location, "-o", "json"])
-    versions = json.loads(out)["orchestrators"]
-    stable = [i["orchestratorVersion"] for i in versions if not i["isPreview"]]
-    stable.sort()
-    return stable[-1]
+    versions = _get_aks_versions(location)
+    # compare the numeric parts, as strings 1.9 would be newer than 1.10
+    return max(
+        (i["orchestratorVersion"] for i in versions if not i["isPreview"]),
+        key=lambda v: tuple(int(part) for part in v.split(".")),
+    )
+
+
+def _apply_args(server_side: bool = True) -> List[str]:
+    """Arguments of kubectl apply.
+    With server-side apply the API server merges the changes in a single request, without the client reading
+    the live object first. The package owns the fields it applies, so conflicts with other managers are overridden.
+
+    Args:
+        server_side (bool, optional): whether to use server-side apply. Defaults to True.
+
+    Returns:
+        List[str]: kubectl arguments
+    """
+    if not server_side:
+        return ["apply"]
+    return ["apply", "--server-side", "--field-manager", _FIELD_MANAGER, "--force-conflicts"]
 
 
 class KubeControl:
     """Wrapper around the kubectl CLI tool"""
 
-    def __init__(self, namespace: str, wait: bool = True):
+    def __init__(self, namespace: str, wait: bool = True, use_proxy: bool = False):
         """Create the kubectl object with a namespace
 
         Args:
             namespace (str): namespace name
             wait (bool, optional): wait for requests to finish. Defaults to True.
+            use_proxy (bool, optional): read resources through the kubectl proxy shared by every KubeControl,
+                which authenticates only once. Defaults to False.
         """
         self.namespace = namespace
+        self.namespace_args = ["--namespace", self.namespace]
         self.wait_args = [] if not wait else ["--wait"]
 
-    def kube_cmd(self, args: List[str], namespaced: bool = True) -> Tuple[str, str]:
+        self._use_proxy = use_proxy
+        if use_proxy:
+            _PROXY.acquire()
+
+    def close(self) -> None:
+        """Release the shared kubectl proxy, it is stopped when no KubeControl uses it any more.
+        The object can still be used, it reads resources with kubectl afterwards.
+        """
+        if self._use_proxy:
+            self._use_proxy = False
+            _PROXY.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_details) -> None:
+        self.close()
+
+    def kube_cmd(self, args: List[str], namespaced: bool = True, input: Optional[str] = None) -> Tuple[str, str]:
         """Run a kubectl command with given arguments in a given namespace
 
         Args:
             args (list): kubectl command arguments in order
             namespaced (bool, optional): whether to run it in cluster level or namespaced. Defaults to True.
+            input (Optional[str], optional): text to pass to kubectl on its standard input. Defaults to None.
 
         Returns:
             Tuple[str, str]: output, error of the run shell command
         """
-        namespace_args = [] if not namespaced else ["--namespace", self.namespace]
-        wait_args = [] if args[0] in ["create", "get", "rollout", "label", "scale", "logs"] else self.wait_args
+        cmd = ["kubectl"]
+        cmd.extend(args)
+        if namespaced:
+            cmd.extend(self.namespace_args)
+        if args[0] not in _NO_WAIT_COMMANDS:
+            cmd.extend(self.wait_args)
+
+        try:
+            return run_shell_command(cmd, poll=False, input=input)
+        finally:
+            if args[0] not in _READ_COMMANDS:
+                # cluster level commands can change resources in any namespace
+                invalidate_list_cache(self.namespace if namespaced else None)
 
-        return run_shell_command(["kubectl"] + args + namespace_args + wait_args, poll=False)
+    def kube_cmds(
+        self, commands: List[List[str]], namespaced: bool = True, max_workers: int = 8
+    ) -> List[Tuple[str, str]]:
+        """Run independent kubectl commands concurrently
+
+        Args:
+            commands (List[List[str]]): kubectl command arguments of each command
+            namespaced (bool, optional): whether to run them in cluster level or namespaced. Defaults to True.
+            max_workers (int, optional): maximum number of kubectl processes at once. Defaults to 8.
+
+        Raises:
+            RuntimeError: If any of the commands fails, after every command finished
+
+        Returns:
+            List[Tuple[str, str]]: output, error of the commands in order
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda args: self.kube_cmd(args, namespaced=namespaced), commands))
+
+    def _list(self, resource_type: str) -> List:
+        """List the resources of a type in the namespace.
+        Lists are cached for a few seconds, commands which change the cluster drop them.
+
+        Args:
+            resource_type (str): type of the resource (like svc or jobs.batch)
+
+        Returns:
+            List: resource descriptors, a copy which the caller may change
+        """
+        key = (self.namespace, resource_type)
+        with _LIST_CACHE_LOCK:
+            cached = _LIST_CACHE.get(key)
+            generation = _LIST_CACHE_GENERATION
+        if cached and cached[1] > time.monotonic():
+            return copy.deepcopy(cached[0])
+
+        if self._use_proxy and resource_type in _LIST_PATHS:
+            items = _PROXY.get(_LIST_PATHS[resource_type].format(namespace=self.namespace))["items"]
+        else:
+            out, _ = self.kube_cmd(["get", resource_type, "-o", "json"])
+            items = json.loads(out)["items"]
+        with _LIST_CACHE_LOCK:
+            # a change made while listing may be missing from the list, keep it out of the cache then
+            if generation == _LIST_CACHE_GENERATION:
+                _LIST_CACHE[key] = (items, time.monotonic() + _LIST_CACHE_TTL)
+        return copy.deepcopy(items)
 
     def delete_namespace(self, tolerate_error: bool = False) -> None:
         """Delete the object namespace
@@ -129,8 +403,33 @@ class KubeControl:
             name (str): name of the resource
             labels (dict): labels to add to the resource
         """
-        for key, value in labels.items():
-            self.kube_cmd(["label", f"{resource_type}/{name}", f"{key}={value}"], namespaced=False)
+        if not labels:
+            return
+        # every label is set by a single kubectl run
+        self.kube_cmd(
+            ["label", f"{resource_type}/{name}"] + [f"{key}={value}" for key, value in labels.items()], namespaced=False
+        )
+
+    def _create_secret(self, name: str, secret_type: str, data: Dict[str, bytes]) -> str:
+        """Create a secret in the namespace from a manifest built in memory, with a single kubectl run
+
+        Args:
+            name (str): name of the secret
+            secret_type (str): kubernetes type of the secret (like Opaque or kubernetes.io/tls)
+            data (Dict[str, bytes]): secret values by key
+
+        Returns:
+            str: the result stdout of the creation
+        """
+        secret = {
+            "apiVersion": "v1",
+            "kind": "Secret",
+            "metadata": {"name": name, "namespace": self.namespace},
+            "type": secret_type,
+            "data": {key: base64.b64encode(value).decode() for key, value in data.items()},
+        }
+        out, _ = self.kube_cmd(["create", "-f", "-"], input=json.dumps(secret))
+        return out
 
     def create_secret_from_literals(self, name: str, literals: dict) -> None:
         """Create a kubernetes secret from literals dictionary
@@ -139,19 +438,18 @@ class KubeControl:
             name (str): name of the secret
             literals (dict): key-secret dictionary
         """
-        base_cmd = ["create", "secret", "generic", name]
-        literals = [f"--from-literal={key}={item}" for key, item in literals.items()]
-        self.kube_cmd(base_cmd + literals)
+        self._create_secret(name, "Opaque", {key: str(item).encode() for key, item in literals.items()})
 
     def create_secret_from_file(self, name: str, path: Path) -> None:
-        """Create a secret from a file
+        """Create a secret from a file, or from every file of a directory
 
         Args:
             name (str): name of the secret
             path (Path): path to the text file
         """
-        base_cmd = ["create", "secret", "generic", name, "--from-file", str(path)]
-        self.kube_cmd(base_cmd)
+        path = Path(path)
+        files = sorted(p for p in path.iterdir() if p.is_file()) if path.is_dir() else [path]
+        self._create_secret(name, "Opaque", {f.name: f.read_bytes() for f in files})
 
     def create_tls_secret(self, secret_name: str, key: str, certificate: str) -> str:
         """Create a tls secret in the Kubernetes namespace
@@ -164,19 +462,8 @@ class KubeControl:
         Returns:
             str: the result stdout during key creation
         """
-        out, _ = self.kube_cmd(
-            [
-                "create",
-                "secret",
-                "tls",
-                secret_name,
-                "--key",
-                str(key),
-                "--cert",
-                str(certificate),
-            ]
-        )
-        return out
+        data = {"tls.crt": Path(certificate).read_bytes(), "tls.key": Path(key).read_bytes()}
+        return self._create_secret(secret_name, "kubernetes.io/tls", data)
 
     def create_docker_secret(self, name: str, user: str, password: str, server: str) -> None:
         """Create a docker registry secret
@@ -187,20 +474,9 @@ class KubeControl:
             password (str): password
             server (str): server url (domain name or docker hub str)
         """
-        self.kube_cmd(
-            [
-                "create",
-                "secret",
-                "docker-registry",
-                name,
-                "--docker-server",
-                server,
-                "--docker-username",
-                user,
-                "--docker-password",
-                password,
-            ]
-        )
+        auth = base64.b64encode(f"{user}:{password}".encode()).decode()
+        config = {"auths": {server: {"username": user, "password": password, "auth": auth}}}
+        self._create_secret(name, "kubernetes.io/dockerconfigjson", {".dockerconfigjson": json.dumps(config).encode()})
 
     def copy_secret(self, name: str, from_namespace: str) -> None:
         """Copy Kubernetes secret from another namespace
@@ -209,13 +485,22 @@ class KubeControl:
             name (str): name of the secret
             from_namespace (str): where to copy the secret from
         """
-        run_shell_command(
-            f"kubectl get secret {name} --namespace={from_namespace} -oyaml | "
-            f"sed -e 's@namespaces/{from_namespace}@namespaces/{self.namespace}@' | "
-            f"sed -e 's@namespace: {from_namespace}@namespace: \"{self.namespace}\"@' | "
-            f"kubectl apply --namespace={self.namespace} -f -",
-            shell=True,
+        out, _ = run_shell_command(
+            ["kubectl", "get", "secret", name, "--namespace", from_namespace, "-o", "json"], poll=False
         )
+        secret = json.loads(out)
+
+        # keep only the metadata which identifies the secret, the rest belongs to the original object
+        metadata = secret["metadata"]
+        annotations = metadata.get("annotations", {})
+        annotations.pop("kubectl.kubernetes.io/last-applied-configuration", None)
+        secret["metadata"] = {"name": metadata["name"], "namespace": self.namespace}
+        if metadata.get("labels"):
+            secret["metadata"]["labels"] = metadata["labels"]
+        if annotations:
+            secret["metadata"]["annotations"] = annotations
+
+        self.kube_cmd(_apply_args() + ["-f", "-"], input=json.dumps(secret))
 
     def get_secrets(self) -> List:
         """Get secrets in the current namespace
@@ -223,9 +508,7 @@ class KubeControl:
         Returns:
             List: secrets
         """
-        out, _ = self.kube_cmd(["get", "secrets", "-o", "json"])
-        secret_dict = json.loads(out)
-        return secret_dict["items"]
+        return self._list("secrets")
 
     def get_services(self) -> List:
         """Get running services description
@@ -233,8 +516,7 @@ class KubeControl:
         Returns:
             List: list of deployment descriptors
         """
-        out, _ = self.kube_cmd(["get", "svc", "-o", "json"])
-        return json.loads(out)["items"]
+        return self._list("svc")
 
     def get_deployments(self) -> List:
         """Get running deployments in namespace
@@ -242,8 +524,7 @@ class KubeControl:
         Returns:
             List: list of deployments
         """
-        out, _ = self.kube_cmd(["get", "deployments.apps", "-o", "json"])
-        return json.loads(out)["items"]
+        return self._list("deployments.apps")
 
     def get_jobs(self) -> List:
         """Get jobs
@@ -251,63 +532,196 @@ class KubeControl:
         Returns:
             List: jobs
         """
-        out, _ = self.kube_cmd(["get", "jobs.batch", "-o", "json"])
-        return json.loads(out)["items"]
+        return self._list("jobs.batch")
+
+    def _get_by_name(self, resource_type: str, name: str) -> Optional[dict]:
+        """Get a single resource of the namespace, the API server filters it by name
+
+        Args:
+            resource_type (str): type of the resource (like svc or jobs.batch)
+            name (str): name of the resource
+
+        Returns:
+            Optional[dict]: the resource descriptor or None if it does not exist
+        """
+        if self._use_proxy and resource_type in _LIST_PATHS:
+            path = _LIST_PATHS[resource_type].format(namespace=self.namespace)
+            items = _PROXY.get(path, params={"fieldSelector": f"metadata.name={name}"})["items"]
+        else:
+            out, _ = self.kube_cmd(["get", resource_type, "--field-selector", f"metadata.name={name}", "-o", "json"])
+            items = json.loads(out)["items"]
+        return next(iter(items), None)
+
+    def get_service(self, name: str) -> Optional[dict]:
+        """Get a service description by name
+
+        Args:
+            name (str): name of the service
+
+        Returns:
+            Optional[dict]: service descriptor or None if it does not exist
+        """
+        return self._get_by_name("svc", name)
+
+    def get_job(self, name: str) -> Optional[dict]:
+        """Get a job by name
+
+        Args:
+            name (str): name of the job
+
+        Returns:
+            Optional[dict]: job descriptor or None if it does not exist
+        """
+        return self._get_by_name("jobs.batch", name)
+
+    def get_fields(self, resource_type: str, name: str, template: str) -> str:
+        """Get fields of a resource rendered by a kubectl jsonpath template,
+        only the requested fields are printed instead of the whole object.
+
+        Args:
+            resource_type (str): type of the resource (like svc or jobs.batch)
+            name (str): name of the resource
+            template (str): kubectl jsonpath template (like {.status.succeeded})
+
+        Raises:
+            RuntimeError: If the resource does not exist
+
+        Returns:
+            str: the rendered template
+        """
+        out, _ = self.kube_cmd(["get", resource_type, name, "-o", f"jsonpath={template}"])
+        return out.strip()
+
+    def get_ingress_public_ips(self, name: str) -> List[str]:
+        """Get the current public IP addresses of a service without waiting for them
+
+        Args:
+            name (str): name of the service
+
+        Returns:
+            List[str]: public IP addresses, empty if none is assigned yet
+        """
+        return self.get_fields("svc", name, _INGRESS_IPS_TEMPLATE).split()
 
-    def wait_and_get_ingress_public_ip(self, name: str) -> List:
+    def watch(self, resource_type: str, name: str, template: str, timeout: float = None) -> Iterator[str]:
+        """Watch a resource in the namespace and yield a line for each of its changes.
+        The lines are rendered by kubectl from a jsonpath template, the API server pushes the changes,
+        so nothing is polled. The resource does not need to exist yet.
+
+        Args:
+            resource_type (str): type of the resource (like svc or jobs.batch)
+            name (str): name of the resource
+            template (str): kubectl jsonpath template of a line, without the trailing newline
+            timeout (float, optional): seconds to watch for, None to watch until stopped. Defaults to None.
+
+        Raises:
+            RuntimeError: If kubectl fails
+            TimeoutError: If the timeout is over
+
+        Yields:
+            str: the rendered template for the current state of the resource
+        """
+        cmd = [
+            "kubectl",
+            "get",
+            resource_type,
+            *self.namespace_args,
+            "--field-selector",
+            f"metadata.name={name}",
+            "--watch",
+            "--output",
+            f'jsonpath={template}{{"\\n"}}',
+        ]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"{resource_type}/{name} did not reach the expected state in {timeout}s")
+
+            with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as process:
+                # the blocking read of the watch is ended by stopping kubectl at the deadline
+                timer = None
+                if deadline is not None:
+                    timer = threading.Timer(deadline - time.monotonic(), process.terminate)
+                    timer.start()
+                try:
+                    for line in process.stdout:
+                        yield line.strip()
+                finally:
+                    if timer:
+                        timer.cancel()
+                    if process.poll() is None:
+                        process.terminate()
+                    stderr = process.stderr.read()
+            expired = deadline is not None and time.monotonic() >= deadline
+            if process.returncode != 0 and not expired:
+                logging.error(stderr)
+                raise RuntimeError(f"Could not watch {resource_type}/{name}")
+            # the API server closes watches after a while, continue with a new one
+
+    def wait_and_get_ingress_public_ip(self, name: str, timeout: float = None) -> List:
         """Wait and get ingress public IP address of  a running deployment
 
         Args:
             name (str): name of the ingress
+            timeout (float, optional): maximum wait in seconds, None to wait until it is ready. Defaults to None.
 
         Raises:
-            RuntimeError: If ingress is not available after the service is up
+            TimeoutError: If the service gets no public IP within the timeout
 
         Returns:
             List: list of public IP addresses
         """
-        while True:
-            services = self.get_services()
-            for svc in services:
-                if svc["metadata"]["name"] == name and len(svc["status"]["loadBalancer"]) > 0:
-                    ingress = svc["status"]["loadBalancer"]["ingress"]
-                    public_ips = [x["ip"] for x in ingress]
-                    if len(public_ips) == 0:
-                        raise RuntimeError("No public IP found.")
-                    return public_ips
-            time.sleep(1)
-
-    def wait_for_job_to_finish(self, name: str) -> bool:
+        for ips in self.watch("svc", name, _INGRESS_IPS_TEMPLATE, timeout=timeout):
+            if ips:
+                return ips.split()
+
+    def wait_for_job_to_finish(self, name: str, timeout: float = None) -> bool:
         """Wait for a job to finish with successful result
 
         Args:
             name (str): name of the job
+            timeout (float, optional): maximum wait in seconds, None to wait until it finishes. Defaults to None.
+
+        Raises:
+            TimeoutError: If the job does not finish within the timeout
 
         Returns:
             bool: whether the job is successful
         """
-        while True:
-            jobs = self.get_jobs()
-            for job in jobs:
-                if (
-                    job["metadata"]["name"] == name
-                    and "completionTime" in job["status"]
-                    and len(job["status"]["completionTime"]) == 20
-                ):
-                    return job["status"]["succeeded"] == 1
-            time.sleep(1)
-
-    def apply(self, path: Path, namespaced: bool = True) -> str:
+        watch = self.watch("jobs.batch", name, "{.status.succeeded},{.status.completionTime}", timeout=timeout)
+        for status in watch:
+            succeeded, completion_time = status.split(",")
+            # any RFC 3339 timestamp, with or without fractional seconds
+            if completion_time:
+                return succeeded == "1"
+
+    def apply(self, path: Path, namespaced: bool = True, server_side: bool = True) -> str:
         """Apply a yaml configuration
 
         Args:
             path (Path): yaml path or directory of descriptions
             namespaced (bool, optional): whether to deploy in a namespace or cluster-level. Defaults to True.
+            server_side (bool, optional): let the API server merge the changes. Defaults to True.
 
         Returns:
             str: the result of the command
         """
-        cmd = ["apply", "-f", str(path)]
+        return self.apply_many([path], namespaced=namespaced, server_side=server_side)
+
+    def apply_many(self, paths: List[Path], namespaced: bool = True, server_side: bool = True) -> str:
+        """Apply several yaml configurations with a single kubectl run
+
+        Args:
+            paths (List[Path]): yaml paths or directories of descriptions
+            namespaced (bool, optional): whether to deploy in a namespace or cluster-level. Defaults to True.
+            server_side (bool, optional): let the API server merge the changes. Defaults to True.
+
+        Returns:
+            str: the result of the command
+        """
+        cmd = _apply_args(server_side)
+        for path in paths:
+            cmd.extend(["-f", str(path)])
         out, _ = self.kube_cmd(cmd, namespaced=namespaced)
         return out
 
@@ -330,8 +744,40 @@ class KubeControl:
         Returns:
             str: the logs as a string
         """
-        out, _ = self.kube_cmd(["logs", pod_name] + ([] if not since else [f"--since={since}"]))
-        return out
+        return "".join(self.stream_logs(pod_name, since=since))
+
+    def stream_logs(self, pod_name: str, since: str = None, follow: bool = False) -> Iterator[str]:
+        """Stream logs from a pod line by line as kubectl prints them, without keeping them in memory
+
+        Args:
+            pod_name (str): name of the pod
+            since (str, optional): since in  a format like (20s, 15m). Defaults to None.
+            follow (bool, optional): keep streaming new logs until the pod stops. Defaults to False.
+
+        Raises:
+            RuntimeError: If kubectl fails
+
+        Yields:
+            str: log lines with their line endings
+        """
+        cmd = ["kubectl", "logs", pod_name, *self.namespace_args]
+        if since:
+            cmd.append(f"--since={since}")
+        if follow:
+            cmd.append("--follow")
+
+        with subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8", errors="replace"
+        ) as process:
+            try:
+                yield from process.stdout
+            finally:
+                if process.poll() is None:
+                    process.terminate()
+                stderr = process.stderr.read()
+        if process.returncode != 0:
+            logging.error(stderr)
+            raise RuntimeError(f"Could not get logs of pod {pod_name}")
 
     def scale_deployment(self, name: str = None, replicas: int = 1) -> None:
         """Scale replicas in a deployment
@@ -341,3 +787,29 @@ class KubeControl:
             replicas (int, optional): replica count. Defaults to 1.
         """
         self.kube_cmd(["scale", "deployment", name, "--replicas", str(replicas)])
+
+
+def list_in_namespaces(resource_type: str, namespaces: List[str], max_workers: int = 8) -> Dict[str, List]:
+    """List the resources of a type in several namespaces concurrently.
+    The requests go through the shared kubectl proxy, so the cluster is authenticated only once for all of them.
+
+    Args:
+        resource_type (str): type of the resource (one of secrets, svc, deployments.apps, jobs.batch)
+        namespaces (List[str]): namespace names
+        max_workers (int, optional): maximum number of parallel requests. Defaults to 8.
+
+    Returns:
+        Dict[str, List]: resource descriptors by namespace
+    """
+
+    def list_namespace(namespace: str) -> List:
+        with KubeControl(namespace, use_proxy=True) as kube:
+            return kube._list(resource_type)
+
+    # hold the proxy for the whole listing, so it is not stopped between namespaces
+    _PROXY.acquire()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(namespaces, executor.map(list_namespace, namespaces)))
+    finally:
+        _PROXY.release()
@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+from nnstorm_cloud.kubernetes import helm
+from nnstorm_cloud.kubernetes.helm import HelmAPI, _set_args
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    """Record the helm commands instead of running them.
+    Commands wait while the returned event is cleared, repo updates fail as many times as failures has items.
+    """
+    monkeypatch.setattr(HelmAPI, "_repos", {})
+    monkeypatch.setattr(HelmAPI, "_repos_dirty", False)
+    calls = []
+    failures = []
+    proceed = threading.Event()
+    proceed.set()
+
+    def run_shell_command(cmd, **kwargs):
+        calls.append(cmd)
+        proceed.wait(5)
+        if cmd[-1] == "fail":
+            raise RuntimeError("failed")
+        if cmd[1:] == ["repo", "update"] and failures:
+            failures.pop()
+            raise RuntimeError("failed")
+        return "", ""
+
+    monkeypatch.setattr(helm, "run_shell_command", run_shell_command)
+    return calls, proceed, failures
+
+
+def test_set_args_plain_values():
+    assert _set_args({"a": "x", "b": 2}) == ["--set", "a=x,b=2"]
+
+
+def test_set_args_escapes_commas():
+    assert _set_args({"a": "x,y"}) == ["--set", "a=x\\,y"]
+
+
+def test_set_args_lists():
+    assert _set_args({"a": ["x", "y"], "b": ("z",)}) == ["--set", "a={x,y},b={z}"]
+    assert _set_args({"a": "{x,y}"}) == ["--set", "a={x,y}"]
+
+
+def test_set_args_empty():
+    assert _set_args({}) == []
+
+
+def test_add_repo_waits_for_add_in_progress(commands):
+    calls, proceed, _ = commands
+    proceed.clear()
+    first = threading.Thread(target=HelmAPI("ns").add_repo_deferred, args=("repo", "url"))
+    first.start()
+    second = threading.Thread(target=HelmAPI("ns").add_repo_deferred, args=("repo", "url"))
+    second.start()
+    second.join(0.2)
+    assert second.is_alive()
+
+    proceed.set()
+    first.join()
+    second.join()
+    assert calls == [["helm", "repo", "add", "repo", "url"]]
+    assert HelmAPI._repos_dirty
+
+
+def test_add_repo_failure_can_be_retried(commands):
+    calls, _, _ = commands
+    with pytest.raises(RuntimeError):
+        HelmAPI("ns").add_repo_deferred("repo", "fail")
+    assert "fail" not in HelmAPI._repos
+    with pytest.raises(RuntimeError):
+        HelmAPI("ns").add_repo_deferred("repo", "fail")
+    assert len(calls) == 2
+
+
+def test_flush_repos_waits_for_add_in_progress(commands):
+    calls, proceed, _ = commands
+    proceed.clear()
+    adding = threading.Thread(target=HelmAPI("ns").add_repo_deferred, args=("repo", "url"))
+    adding.start()
+    flushing = threading.Thread(target=HelmAPI("ns").flush_repos)
+    flushing.start()
+    flushing.join(0.2)
+    assert flushing.is_alive()
+
+    proceed.set()
+    adding.join()
+    flushing.join()
+    assert calls[-1] == ["helm", "repo", "update"]
+    assert not HelmAPI._repos_dirty
+
+
+def test_flush_repos_retries(commands, caplog):
+    calls, _, failures = commands
+    failures.extend([True, True])
+    HelmAPI._repos_dirty = True
+    HelmAPI("ns").flush_repos()
+    assert calls.count(["helm", "repo", "update"]) == 3
+    assert [r.levelname for r in caplog.records] == ["WARNING", "WARNING"]
@@ -0,0 +1,75 @@
+import json
+import time
+
+from nnstorm_cloud.kubernetes import kubectl
+
+
+def test_aks_versions_expire_in_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(kubectl, "_AKS_VERSIONS", {})
+    monkeypatch.setattr(kubectl, "_AKS_VERSIONS_CACHE_DIR", tmp_path)
+    calls = []
+
+    def run_shell_command(cmd, **kwargs):
+        calls.append(cmd)
+        return json.dumps({"orchestrators": [{"orchestratorVersion": f"1.{len(calls)}.0"}]}), ""
+
+    monkeypatch.setattr(kubectl, "run_shell_command", run_shell_command)
+    now = [time.time()]
+    monkeypatch.setattr(kubectl.time, "time", lambda: now[0])
+
+    assert kubectl._get_aks_versions("westeurope") == [{"orchestratorVersion": "1.1.0"}]
+    assert kubectl._get_aks_versions("westeurope") == [{"orchestratorVersion": "1.1.0"}]
+    assert len(calls) == 1
+
+    now[0] += kubectl._AKS_VERSIONS_CACHE_TTL + 1
+    assert kubectl._get_aks_versions("westeurope") == [{"orchestratorVersion": "1.2.0"}]
+    assert len(calls) == 2
+
+
+def test_last_user_stops_the_proxy(monkeypatch):
+    proxy = kubectl._KubeProxy()
+    stops = []
+    monkeypatch.setattr(proxy, "_stop", lambda: stops.append(True))
+    monkeypatch.setattr(kubectl, "_PROXY", proxy)
+
+    with kubectl.KubeControl("a", use_proxy=True):
+        with kubectl.KubeControl("b", use_proxy=True) as kube:
+            kube.close()
+        assert not stops
+    assert stops == [True]
+
+    kubectl.KubeControl("c").close()
+    assert stops == [True]
+
+
+def _fake_get(monkeypatch, on_get=None):
+    monkeypatch.setattr(kubectl, "_LIST_CACHE", {})
+    calls = []
+
+    def run_shell_command(cmd, **kwargs):
+        calls.append(cmd)
+        if on_get:
+            on_get()
+        return json.dumps({"items": [{"metadata": {"name": "svc1"}}]}), ""
+
+    monkeypatch.setattr(kubectl, "run_shell_command", run_shell_command)
+    return calls
+
+
+def test_list_is_not_cached_when_invalidated_meanwhile(monkeypatch):
+    # a change finishing while the list runs
+    calls = _fake_get(monkeypatch, on_get=lambda: kubectl.invalidate_list_cache("ns"))
+    kube = kubectl.KubeControl("ns")
+    kube.get_services()
+    kube.get_services()
+    assert len(calls) == 2
+
+
+def test_list_returns_copies(monkeypatch):
+    calls = _fake_get(monkeypatch)
+    kube = kubectl.KubeControl("ns")
+    kube.get_services()[0]["metadata"]["name"] = "changed"
+    assert kube.get_services()[0]["metadata"]["name"] == "svc1"
+    kube.get_services()[0]["metadata"]["name"] = "changed"
+    assert kube.get_services()[0]["metadata"]["name"] == "svc1"
+    assert len(calls) == 1